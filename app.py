@@ -1,28 +1,120 @@
 import os
+import re
 import json
+import time
+import uuid
 import base64
-from flask import Flask, request, jsonify, render_template, send_from_directory
+import threading
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory, stream_with_context
 from werkzeug.utils import secure_filename
 import tempfile
 import shutil
 from pdf_processor import PDFProcessor
 from excel_processor import ExcelProcessor
 from azure_ai_processor import AzureAIProcessor
+from job_manager import JobManager, JobStore
+from storage_manager import StorageManager
+from result_store import ResultStore
+from chunked_upload import ChunkedUploadManager, UploadIndex, UploadError, file_sha256
+from metrics import REGISTRY, span
+
+try:
+    import resource
+except ImportError:
+    # Windows : pas de mesure de la mémoire du worker
+    resource = None
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['IMAGES_FOLDER'] = 'images'
 app.config['OUTPUT_FOLDER'] = 'output'
+app.config['PDF_PAGE_WINDOW'] = int(os.getenv('PDF_PAGE_WINDOW', '4'))  # pages rendues en mémoire
+app.config['JOB_CONCURRENCY'] = int(os.getenv('JOB_CONCURRENCY', '2'))  # documents traités en parallèle
+app.config['PDF_TEXT_FIRST'] = os.getenv('PDF_TEXT_FIRST', '1') == '1'  # couche texte avant la vision
+app.config['EXCEL_STREAMING'] = os.getenv('EXCEL_STREAMING', '0') == '1'  # export Excel write-only
+app.config['MAX_PDF_PAGES'] = int(os.getenv('MAX_PDF_PAGES', '500'))  # refus des documents trop longs
+app.config['STORAGE_RETENTION'] = os.getenv('STORAGE_RETENTION', '1') == '1'  # nettoyage des dossiers
 
 # Créer les dossiers nécessaires
 for folder in [app.config['UPLOAD_FOLDER'], app.config['IMAGES_FOLDER'], app.config['OUTPUT_FOLDER']]:
     os.makedirs(folder, exist_ok=True)
 
-# Initialiser les processeurs
-pdf_processor = PDFProcessor()
-excel_processor = ExcelProcessor()
-azure_processor = AzureAIProcessor()
+class Lazy:
+    """
+    Objet construit au premier usage. Le module peut ainsi être importé une
+    seule fois avant le fork des workers (gunicorn --preload) : connexions
+    SQLite, pools HTTP et threads sont créés dans chaque worker, jamais
+    partagés entre processus. L'accès à l'objet construit passe par
+    `resolve` pour ne masquer aucune méthode de l'objet (ex: get).
+    """
+    def __init__(self, factory):
+        self.factory = factory
+        self.instance = None
+        self.lock = threading.Lock()
+    
+    def resolve(self):
+        if self.instance is None:
+            with self.lock:
+                if self.instance is None:
+                    self.instance = self.factory()
+        return self.instance
+    
+    @property
+    def ready(self) -> bool:
+        return self.instance is not None
+    
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+def create_storage() -> StorageManager:
+    manager = StorageManager({
+        'uploads': app.config['UPLOAD_FOLDER'],
+        'images': app.config['IMAGES_FOLDER'],
+        'output': app.config['OUTPUT_FOLDER']
+    })
+    # Sessions d'envoi par morceaux abandonnées, invisibles du manifeste
+    manager.sweep_hooks.append(lambda: chunked_uploads.expire_sessions())
+    if app.config['STORAGE_RETENTION']:
+        manager.start()
+    return manager
+
+# Initialiser les processeurs (au premier usage, voir warm_up)
+pdf_processor = Lazy(lambda: PDFProcessor(page_window=app.config['PDF_PAGE_WINDOW']))
+excel_processor = Lazy(ExcelProcessor)
+azure_processor = Lazy(AzureAIProcessor)
+job_manager = Lazy(lambda: JobManager(max_workers=app.config['JOB_CONCURRENCY'], store=JobStore()))
+result_store = Lazy(ResultStore)
+upload_index = Lazy(UploadIndex)
+chunked_uploads = Lazy(lambda: ChunkedUploadManager(app.config['UPLOAD_FOLDER'], upload_index.resolve(),
+                                                    max_pages=app.config['MAX_PDF_PAGES']))
+storage = Lazy(create_storage)
+
+# Préchauffage du worker : fin, durée et erreur éventuelle
+warm_state = {'ready_at': None, 'seconds': None, 'error': None}
+
+def warm_up():
+    """
+    Construit les processeurs du worker et ouvre les connexions vers Azure
+    AI avant la première requête (appelé par gunicorn après le fork, voir
+    gunicorn.conf.py). Une configuration incomplète n'empêche pas le worker
+    de démarrer : /healthz la signale.
+    """
+    started = time.perf_counter()
+    with span('warm_up'):
+        for lazy in (pdf_processor, excel_processor, job_manager, result_store,
+                     upload_index, chunked_uploads, storage):
+            lazy.resolve()
+        try:
+            azure_processor.resolve().warm_up()
+            warm_state['error'] = None
+        except Exception as e:
+            warm_state['error'] = str(e)
+    warm_state['seconds'] = round(time.perf_counter() - started, 3)
+    warm_state['ready_at'] = time.time()
+
+# Identifiants d'upload et de job (uuid4 en hexadécimal)
+WORKSPACE_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
 
 @app.route('/')
 def index():
@@ -40,71 +132,497 @@ def upload_files():
         if pdf_file.filename == '' or excel_file.filename == '':
             return jsonify({'error': 'Fichiers non sélectionnés'}), 400
         
-        # Sauvegarder les fichiers
-        pdf_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(pdf_file.filename))
-        excel_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(excel_file.filename))
+        # Sauvegarder les fichiers dans un dossier propre à cet upload :
+        # deux fichiers de même nom envoyés en même temps ne s'écrasent pas
+        upload_id = uuid.uuid4().hex
+        upload_folder = os.path.join(app.config['UPLOAD_FOLDER'], upload_id)
+        os.makedirs(upload_folder)
+        pdf_path = os.path.join(upload_folder, secure_filename(pdf_file.filename) or 'document.pdf')
+        excel_path = os.path.join(upload_folder, secure_filename(excel_file.filename) or 'classeur.xlsx')
         
         pdf_file.save(pdf_path)
+        
+        # Contrôle d'admission rapide : lecture des métadonnées sans rendu
+        try:
+            pdf_info = pdf_processor.get_pdf_info(pdf_path)
+        except Exception:
+            shutil.rmtree(upload_folder, ignore_errors=True)
+            return jsonify({'error': 'Fichier PDF invalide ou illisible'}), 400
+        
+        if pdf_info['page_count'] > app.config['MAX_PDF_PAGES']:
+            shutil.rmtree(upload_folder, ignore_errors=True)
+            return jsonify({
+                'error': f"PDF trop long: {pdf_info['page_count']} pages (maximum {app.config['MAX_PDF_PAGES']})"
+            }), 413
+        
         excel_file.save(excel_path)
+        storage.register(pdf_path)
+        storage.register(excel_path)
+        upload_index.add(pdf_path, file_sha256(pdf_path), os.path.getsize(pdf_path))
         
         return jsonify({
             'message': 'Fichiers uploadés avec succès',
+            'upload_id': upload_id,
             'pdf_path': pdf_path,
-            'excel_path': excel_path
+            'excel_path': excel_path,
+            'pdf_info': pdf_info
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/uploads/chunked', methods=['POST'])
+def create_chunked_upload():
+    """
+    Ouvre un envoi par morceaux : {filename, size, upload_id (facultatif,
+    pour ajouter un fichier à un envoi existant)}
+    """
+    data = request.get_json() or {}
+    upload_id = data.get('upload_id') or uuid.uuid4().hex
+    if not WORKSPACE_ID_PATTERN.match(str(upload_id)):
+        return jsonify({'error': 'Identifiant d\'envoi invalide'}), 400
+    try:
+        status = chunked_uploads.create(upload_id, data.get('filename'), data.get('size'))
+        return jsonify(finish_chunked_upload(status)), 200 if status['complete'] else 201
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+
+@app.route('/uploads/chunked/<upload_id>/<filename>', methods=['GET'])
+def chunked_upload_status(upload_id, filename):
+    if not WORKSPACE_ID_PATTERN.match(upload_id):
+        return jsonify({'error': 'Envoi introuvable'}), 404
+    try:
+        return jsonify(chunked_uploads.status(upload_id, filename))
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+
+@app.route('/uploads/chunked/<upload_id>/<filename>', methods=['PUT'])
+def append_chunked_upload(upload_id, filename):
+    """
+    Reçoit un morceau (corps brut) à la position ?offset=N ou Content-Range
+    """
+    if not WORKSPACE_ID_PATTERN.match(upload_id):
+        return jsonify({'error': 'Envoi introuvable'}), 404
+    offset = request.args.get('offset')
+    content_range = request.headers.get('Content-Range', '')
+    if offset is None and content_range.startswith('bytes '):
+        offset = content_range[6:].split('-', 1)[0]
+    try:
+        status = chunked_uploads.append(upload_id, filename, int(offset or 0), request.stream)
+        return jsonify(finish_chunked_upload(status))
+    except ValueError:
+        return jsonify({'error': 'Position invalide'}), 400
+    except UploadError as e:
+        if e.status in (413, 415):
+            # Fichier refusé d'après ses premiers octets : inutile de garder la session
+            chunked_uploads.abort(upload_id, filename)
+        return jsonify({'error': str(e)}), e.status
+
+def finish_chunked_upload(status):
+    """
+    Contrôle d'admission d'un PDF complet et liens vers les traitements
+    existants d'un fichier identique
+    """
+    if not status['complete']:
+        return status
+    path = status['path']
+    if status.get('duplicate_of'):
+        status['duplicate_of'] = os.path.relpath(status['duplicate_of'])
+    # Contrôlé même s'il est identique à un fichier déjà reçu : la limite de
+    # pages a pu changer, et un doublon refusé ne supprime que son lien
+    if path.lower().endswith('.pdf'):
+        try:
+            status['pdf_info'] = pdf_processor.get_pdf_info(path)
+        except Exception:
+            chunked_uploads.abort(status['upload_id'], status['filename'])
+            raise UploadError('Fichier PDF invalide ou illisible', 400)
+        if status['pdf_info']['page_count'] > app.config['MAX_PDF_PAGES']:
+            chunked_uploads.abort(status['upload_id'], status['filename'])
+            raise UploadError(
+                f"PDF trop long: {status['pdf_info']['page_count']} pages (maximum {app.config['MAX_PDF_PAGES']})", 413)
+    # Ajouté au manifeste une fois accepté : un fichier refusé est supprimé aussitôt
+    storage.register(path)
+    if status.get('sha256'):
+        status['jobs'] = [
+            {
+                'job_id': job_id,
+                'result_url': f'/jobs/{job_id}/result',
+                'results_url': f'/results?job_id={job_id}',
+                'download_url': f'/jobs/{job_id}/download'
+            }
+            for job_id in upload_index.jobs(status['sha256'])
+        ]
+    return status
+
 @app.route('/process', methods=['POST'])
 def process_files():
     try:
         data = request.get_json()
-        pdf_path = data.get('pdf_path')
-        excel_path = data.get('excel_path')
         prompt = data.get('prompt', 'Analysez cette image et extrayez les informations importantes')
+        text_first = data.get('text_first', app.config['PDF_TEXT_FIRST'])
+        
+        if data.get('upload_id'):
+            pdf_path, excel_path = resolve_upload(data['upload_id'])
+        else:
+            pdf_path, excel_path = data.get('pdf_path'), data.get('excel_path')
         
         if not pdf_path or not excel_path:
             return jsonify({'error': 'Chemins des fichiers manquants'}), 400
+        # Seuls les fichiers envoyés par /upload peuvent être traités
+        if not is_inside(pdf_path, app.config['UPLOAD_FOLDER']) or not is_inside(excel_path, app.config['UPLOAD_FOLDER']):
+            return jsonify({'error': 'Chemins des fichiers invalides'}), 400
         
-        # 1. Convertir PDF en images
-        images_info = pdf_processor.convert_pdf_to_images(pdf_path, app.config['IMAGES_FOLDER'])
-        
-        # 2. Traiter chaque image avec Azure AI
-        results = []
-        for image_info in images_info:
-            image_path = image_info['path']
-            page_num = image_info['page']
-            
-            # Analyser l'image avec Azure AI
-            ai_result = azure_processor.analyze_image(image_path, prompt)
-            
-            results.append({
-                'page': page_num,
-                'image_path': image_path,
-                'ai_result': ai_result
-            })
-        
-        # 3. Mettre à jour le fichier Excel
-        output_excel_path = os.path.join(app.config['OUTPUT_FOLDER'], 'resultat_traite.xlsx')
-        excel_processor.update_excel_with_results(excel_path, results, output_excel_path)
+        # Le traitement tourne en arrière-plan : on retourne l'identifiant du job
+        job = job_manager.submit(run_processing_job, pdf_path, excel_path, prompt, text_first)
+        upload_index.link_job(pdf_path, job.id)
         
         return jsonify({
-            'message': 'Traitement terminé avec succès',
-            'results': results,
-            'output_excel': output_excel_path
-        })
+            'message': 'Traitement mis en file',
+            'job_id': job.id,
+            'status_url': f'/jobs/{job.id}',
+            'events_url': f'/jobs/{job.id}/events',
+            'result_url': f'/jobs/{job.id}/result'
+        }), 202
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def is_inside(path, folder):
+    """
+    Indique si path désigne un fichier situé sous folder
+    """
+    folder = os.path.abspath(folder)
+    return os.path.abspath(path).startswith(folder + os.sep)
+
+def resolve_upload(upload_id):
+    """
+    Chemins du PDF et du classeur Excel d'un upload, ou (None, None)
+    """
+    upload_folder = os.path.join(app.config['UPLOAD_FOLDER'], str(upload_id))
+    if not WORKSPACE_ID_PATTERN.match(str(upload_id)) or not os.path.isdir(upload_folder):
+        return None, None
+    pdf_path = excel_path = None
+    for filename in sorted(os.listdir(upload_folder)):
+        if filename.startswith('.'):
+            # Envoi par morceaux en cours
+            continue
+        if filename.lower().endswith('.pdf'):
+            pdf_path = os.path.join(upload_folder, filename)
+        else:
+            excel_path = os.path.join(upload_folder, filename)
+    return pdf_path, excel_path
+
+def run_processing_job(job, pdf_path, excel_path, prompt, text_first=False):
+    """
+    Conversion PDF, analyse Azure AI et écriture Excel pour un job
+    """
+    # Les fichiers d'entrée ne doivent pas être évincés pendant le traitement
+    with storage.in_use(pdf_path, excel_path):
+        return process_document(job, pdf_path, excel_path, prompt, text_first)
+
+def process_document(job, pdf_path, excel_path, prompt, text_first=False):
+    """
+    Étapes du traitement d'un document (voir run_processing_job)
+    """
+    started = time.perf_counter()
+    # Images et classeur dans des dossiers propres au job
+    images_folder = os.path.join(app.config['IMAGES_FOLDER'], job.id)
+    output_folder = os.path.join(app.config['OUTPUT_FOLDER'], job.id)
+    os.makedirs(output_folder, exist_ok=True)
+    job.update(stage='Conversion PDF en images...',
+               pages_total=pdf_processor.get_page_count(pdf_path))
+    
+    # 1. Convertir PDF en images au fil de l'eau (la page N+1 est rendue
+    #    pendant que la page N est analysée). Les pages ayant une couche texte
+    #    ne sont pas rendues en mode text_first.
+    images_info = pdf_processor.prefetch_pages(pdf_path, images_folder, text_first=text_first)
+    
+    # 2. Traiter les images avec Azure AI en parallèle (résultats dans l'ordre des pages)
+    job.update(stage='Analyse Azure AI...')
+    results = []
+    
+    # Mode adaptatif : les pages mal lues à basse résolution sont rendues à nouveau
+    refine = None
+    if pdf_processor.adaptive_dpi:
+        refine = lambda image_info: pdf_processor.refine_page(pdf_path, image_info, images_folder)
+    
+    def page_results():
+        for image_info, ai_result in azure_processor.analyze_pages(images_info, prompt, refine=refine,
+                                                                     window=pdf_processor.page_window):
+            for image_path in image_info.get('tiles') or [image_info['path']]:
+                if image_path:
+                    # Origine conservée pour régénérer l'aperçu après éviction
+                    storage.register(image_path, size=image_info['size'],
+                                     source={'pdf_path': pdf_path, 'page': image_info['page']})
+            result = {
+                'page': image_info['page'],
+                'image_path': image_info['path'],
+                'image_url': f"/images/{job.id}/{image_info['filename']}" if image_info.get('filename') else None,
+                'source': image_info.get('source', 'image'),
+                'preprocessing': image_info.get('preprocessing'),
+                'timing': image_info.get('timing', {}),
+                'ai_result': ai_result
+            }
+            results.append(result)
+            # Historique interrogeable via /results
+            result_store.add(job.id, os.path.basename(pdf_path), [result])
+            job.update(pages_done=len(results))
+            yield result
+    
+    # 3. Mettre à jour le fichier Excel
+    output_excel_path = os.path.join(output_folder, 'resultat_traite.xlsx')
+    excel_timings = {}
+    if app.config['EXCEL_STREAMING']:
+        # Les lignes sont écrites à mesure que les pages sont analysées
+        excel_processor.export_results_streaming(page_results(), output_excel_path, excel_path)
+    else:
+        for _ in page_results():
+            pass
+        job.update(stage='Écriture du fichier Excel...')
+        with span('excel_update', excel_timings):
+            # Le classeur est une projection des résultats enregistrés pour ce job
+            excel_processor.update_excel_with_results(
+                excel_path, list(result_store.iter_results({'job_id': job.id})), output_excel_path)
+    
+    storage.register(output_excel_path)
+    job.update(stage='Traitement terminé')
+    return {
+        'message': 'Traitement terminé avec succès',
+        'results': results,
+        'output_excel': output_excel_path,
+        'download_url': f'/jobs/{job.id}/download',
+        'deduplication': summarize_deduplication(results),
+        'validation': summarize_validation(results),
+        'already_seen': find_already_seen(job.id, results),
+        'timings': summarize_timings(results, excel_timings, started)
+    }
+
+def summarize_timings(results, excel_timings, started):
+    """
+    Temps cumulés par étape pour un job (en millisecondes). Les étapes se
+    recouvrent (rendu et analyse en parallèle) : leur somme dépasse le temps réel.
+    """
+    timings = {'wall_ms': round((time.perf_counter() - started) * 1000, 1)}
+    for result in results:
+        for stage, value in (result.get('timing') or {}).items():
+            timings[stage] = round(timings.get(stage, 0) + value, 1)
+        ai_timing = result['ai_result'].get('timing') or {}
+        batch = result['ai_result'].get('batch')
+        # Une requête groupée n'est comptée que sur sa première page
+        if batch and result['page'] != batch['pages'][0]:
+            ai_timing = {}
+        if ai_timing and not result['ai_result'].get('cached'):
+            timings['azure_ms'] = round(timings.get('azure_ms', 0) + ai_timing.get('total_ms', 0), 1)
+            timings['azure_retries'] = timings.get('azure_retries', 0) + ai_timing.get('attempts', 1) - 1
+        usage = result['ai_result'].get('usage') or {}
+        timings['prompt_tokens'] = timings.get('prompt_tokens', 0) + usage.get('prompt_tokens', 0)
+        timings['completion_tokens'] = timings.get('completion_tokens', 0) + usage.get('completion_tokens', 0)
+    timings.update(excel_timings)
+    return timings
+
+def summarize_deduplication(results):
+    """
+    Pages non envoyées à Azure (blanches ou en double) et tokens économisés
+    """
+    skipped = [result['ai_result'] for result in results if result['ai_result'].get('deduplicated')]
+    return {
+        'pages_skipped': len(skipped),
+        'blank_pages': sum(1 for ai_result in skipped if ai_result.get('blank')),
+        'tokens_saved': sum((ai_result.get('usage_saved') or {}).get('total_tokens', 0) for ai_result in skipped)
+    }
+
+def summarize_validation(results):
+    """
+    Pages restées non conformes au schéma après les nouvelles demandes (mode structuré)
+    """
+    ai_results = [result['ai_result'] for result in results]
+    return {
+        'invalid_pages': [result['page'] for result in results if result['ai_result'].get('valid') is False],
+        'reask_requests': sum(ai_result.get('reask_attempts', 0) for ai_result in ai_results)
+    }
+
+def find_already_seen(job_id, results):
+    """
+    Pages dont le numéro de document (et l'émetteur) figure déjà dans un job précédent
+    """
+    already_seen = []
+    for result in results:
+        content = result['ai_result'].get('content')
+        if not isinstance(content, dict) or not content.get('numero_document'):
+            continue
+        previous = result_store.seen_before(job_id, str(content['numero_document']), content.get('emetteur'))
+        if previous:
+            already_seen.append({
+                'page': result['page'],
+                'numero_document': content['numero_document'],
+                'emetteur': content.get('emetteur'),
+                'previous': previous
+            })
+    return already_seen
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job introuvable'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job introuvable'}), 404
+    
+    def generate():
+        for state in job_manager.stream(job):
+            if state is None:
+                # Commentaire SSE pour garder la connexion ouverte
+                yield ': keepalive\n\n'
+            else:
+                yield f'data: {json.dumps(state, ensure_ascii=False)}\n\n'
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job introuvable'}), 404
+    if job.status == 'error':
+        return jsonify({'error': job.error}), 500
+    if not job.finished:
+        return jsonify(job.to_dict()), 202
+    return jsonify(job.result)
+
+@app.route('/healthz')
+def healthz():
+    """
+    Sonde de disponibilité : 200 quand le worker est prêt à traiter un
+    document, 503 sinon (configuration Azure absente, préchauffage en échec)
+    """
+    if warm_state['ready_at'] is None or warm_state['error'] is not None:
+        # Nouvelle tentative à chaque sonde tant que le worker n'est pas prêt
+        warm_up()
+    status = {
+        'status': 'ok' if warm_state['error'] is None else 'error',
+        'pid': os.getpid(),
+        'warm_up_seconds': warm_state['seconds'],
+        'uptime_seconds': round(time.time() - warm_state['ready_at'], 1)
+    }
+    if resource is not None:
+        # Pic de mémoire résidente du worker (ru_maxrss est en Ko sous Linux)
+        status['max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    if warm_state['error'] is not None:
+        status['error'] = warm_state['error']
+        return jsonify(status), 503
+    return jsonify(status)
+
+@app.route('/metrics')
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+def result_filters():
+    """
+    Filtres de recherche passés en paramètres de requête (hors pagination)
+    """
+    return {name: value for name, value in request.args.items() if name not in ('limit', 'offset')}
+
+@app.route('/results')
+def query_results():
+    try:
+        limit = min(max(1, int(request.args.get('limit', 50))), 500)
+        offset = max(0, int(request.args.get('offset', 0)))
+        return jsonify(result_store.query(result_filters(), limit=limit, offset=offset))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/results/export')
+def export_results():
+    # Export Excel des résultats filtrés, lu directement depuis l'historique
+    try:
+        results = result_store.iter_results(result_filters())
+        export_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(app.config['OUTPUT_FOLDER'], export_id))
+        output_path = os.path.join(app.config['OUTPUT_FOLDER'], export_id, 'resultats.xlsx')
+        excel_processor.export_results_streaming(results, output_path)
+        storage.register(output_path)
+        return send_output(os.path.join(export_id, 'resultats.xlsx'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/storage')
+def storage_stats():
+    return jsonify(storage.stats())
+
+@app.route('/deployments')
+def deployment_stats():
+    """
+    État de chaque déploiement Azure AI du pool (propre au worker)
+    """
+    try:
+        return jsonify({'deployments': azure_processor.pool.stats()})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 503
+
+@app.route('/jobs/<job_id>/download')
+def download_job_result(job_id):
+    # Résolu par le dossier du job : fonctionne quel que soit le worker qui l'a traité
+    if not WORKSPACE_ID_PATTERN.match(job_id):
+        return jsonify({'error': 'Job introuvable'}), 404
+    return send_output(os.path.join(job_id, 'resultat_traite.xlsx'))
+
 @app.route('/download/<filename>')
 def download_file(filename):
-    return send_from_directory(app.config['OUTPUT_FOLDER'], filename, as_attachment=True)
+    return send_output(secure_filename(filename))
+
+def send_output(name):
+    # Fichier évincé ou inconnu : 404 immédiat, sans parcourir le dossier
+    if storage.locate('output', name) is None:
+        return jsonify({'error': 'Fichier expiré ou introuvable'}), 404
+    return send_from_directory(app.config['OUTPUT_FOLDER'], name, as_attachment=True)
+
+@app.route('/images/<job_id>/<filename>')
+def serve_job_image(job_id, filename):
+    if not WORKSPACE_ID_PATTERN.match(job_id):
+        return jsonify({'error': 'Image expirée ou introuvable'}), 404
+    return send_image(os.path.join(job_id, secure_filename(filename)))
 
 @app.route('/images/<filename>')
 def serve_image(filename):
-    return send_from_directory(app.config['IMAGES_FOLDER'], filename)
+    return send_image(secure_filename(filename))
+
+def send_image(name):
+    if pdf_processor.page_writer is not None:
+        # En mode in_memory, l'image d'aperçu peut être encore en cours d'écriture
+        pdf_processor.page_writer.flush(os.path.join(app.config['IMAGES_FOLDER'], name))
+    if storage.locate('images', name) is None and not regenerate_image(name):
+        return jsonify({'error': 'Image expirée ou introuvable'}), 404
+    return send_from_directory(app.config['IMAGES_FOLDER'], name)
+
+def regenerate_image(name):
+    """
+    Rend à nouveau une page évincée si le PDF d'origine est encore disponible
+    """
+    source = storage.source('images', name)
+    if not source or not is_inside(source['pdf_path'], app.config['UPLOAD_FOLDER']):
+        return False
+    if storage.locate('uploads', os.path.relpath(source['pdf_path'], app.config['UPLOAD_FOLDER'])) is None:
+        return False
+    image_path = os.path.join(app.config['IMAGES_FOLDER'], name)
+    try:
+        image_info = pdf_processor.extract_specific_page(source['pdf_path'], source['page'], os.path.dirname(image_path))
+    except Exception:
+        return False
+    if pdf_processor.page_writer is not None:
+        pdf_processor.page_writer.flush()
+    for tile_path in image_info.get('tiles') or [image_info['path']]:
+        if tile_path:
+            storage.register(tile_path, source=source)
+    return os.path.exists(image_path)
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
+    # Serveur de développement ; en production, voir gunicorn.conf.py
+    app.run(debug=os.getenv('FLASK_DEBUG', '0').lower() in ('1', 'true'), host='0.0.0.0', port=5000) 
\ No newline at end of file
@@ -1,116 +1,1124 @@
 import os
+import re
 import base64
 import requests
 import json
-from typing import Dict, Any
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple, Union
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from result_cache import ResultCache, create_result_cache
+from page_deduplicator import PageDeduplicator
+from metrics import span, PAGES_PROCESSED, AZURE_REQUESTS, AZURE_RETRIES, AZURE_BYTES_UPLOADED, AZURE_TOKENS, CACHE_REQUESTS, AZURE_REASKS, AZURE_DEPLOYMENT_REQUESTS, AZURE_BATCH_FALLBACKS
 
 load_dotenv()
 
+# Estimation grossière du coût en tokens d'une image haute résolution
+IMAGE_TOKEN_ESTIMATE = 765
+
+MIME_TYPES = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.webp': 'image/webp'
+}
+
+# Schéma des données extraites (voir build_structured_prompt) : type attendu et champ obligatoire
+EXTRACTION_SCHEMA = {
+    'type_document': ('string', True),
+    'date': ('date', True),
+    'montant': ('number', True),
+    'devise': ('string', False),
+    'emetteur': ('string', False),
+    'destinataire': ('string', False),
+    'numero_document': ('string', False),
+    'autres_informations': ('object', False)
+}
+
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+# Réponse JSON entourée d'un bloc de code Markdown (```json ... ```)
+FENCED_JSON_PATTERN = re.compile(r'^\s*```(?:json)?\s*\n?(.*?)\n?\s*```\s*$', re.DOTALL | re.IGNORECASE)
+
+class RateLimiter:
+    """
+    Budget glissant sur 60 secondes en requêtes et en tokens par minute,
+    partagé par tous les threads d'un même déploiement
+    """
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = 60.0
+        self.calls = deque()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+    
+    def _wait(self, now: float, tokens: int) -> float:
+        """
+        Attente nécessaire avant d'envoyer la requête (appelé sous verrou)
+        """
+        while self.calls and now - self.calls[0][0] >= self.window:
+            self.calls.popleft()
+        
+        wait = self.blocked_until - now
+        if wait <= 0 and self.requests_per_minute and len(self.calls) >= self.requests_per_minute:
+            wait = self.calls[0][0] + self.window - now
+        if wait <= 0 and self.tokens_per_minute and self.calls:
+            used = sum(t for _, t in self.calls)
+            if used + tokens > self.tokens_per_minute:
+                wait = self.calls[0][0] + self.window - now
+        return wait
+    
+    def wait_time(self, tokens: int = 0) -> float:
+        """
+        Attente avant qu'une requête tienne dans le budget, sans la réserver
+        """
+        with self.lock:
+            return max(0.0, self._wait(time.monotonic(), tokens))
+    
+    def acquire(self, tokens: int = 0):
+        """
+        Bloque jusqu'à ce que la requête tienne dans le budget, puis la réserve
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = self._wait(now, tokens)
+                if wait <= 0:
+                    self.calls.append((now, tokens))
+                    return
+            time.sleep(min(wait, 1.0))
+    
+    def pause(self, seconds: float):
+        """
+        Suspend tous les appels (ex: Retry-After reçu sur un 429)
+        """
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class Deployment:
+    """
+    Déploiement Azure OpenAI d'un pool, avec son propre budget RPM/TPM, la
+    marge restante annoncée par Azure (en-têtes x-ratelimit-remaining-*),
+    sa latence moyenne et un disjoncteur ouvert après plusieurs échecs
+    consécutifs (erreurs réseau et 5xx ; un 429 n'est pas un échec)
+    """
+    def __init__(self, name: str, endpoint: str, deployment_name: str, api_key: str, weight: float = 1.0,
+                 requests_per_minute: int = 0, tokens_per_minute: int = 0,
+                 failure_threshold: int = 5, cooldown: float = 30.0):
+        self.name = name
+        self.endpoint = endpoint.rstrip('/')
+        self.deployment_name = deployment_name
+        self.api_key = api_key
+        self.weight = weight
+        self.url = f"{self.endpoint}/openai/deployments/{deployment_name}/chat/completions?api-version=2024-02-15-preview"
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        # Moyenne mobile exponentielle du temps de réponse (ms)
+        self.latency_ms = None
+        self.remaining_requests = None
+        self.remaining_tokens = None
+        # Plus grande marge observée : sert d'estimation du quota
+        self.max_remaining_tokens = None
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.throttled = 0
+        self.tokens = 0
+        # Réponses réussies des 60 dernières secondes
+        self.recent = deque()
+    
+    def available(self, now: float = None) -> bool:
+        """
+        Disjoncteur fermé, ou délai de refroidissement écoulé (nouvel essai)
+        """
+        return (now or time.monotonic()) >= self.open_until
+    
+    def score(self, tokens: int, default_latency_ms: float) -> float:
+        """
+        Poids de routage : poids configuré × marge restante / latence
+        """
+        with self.lock:
+            headroom = 1.0
+            if self.remaining_tokens is not None and self.max_remaining_tokens:
+                headroom = self.remaining_tokens / self.max_remaining_tokens
+                if self.remaining_tokens < tokens:
+                    headroom = 0.0
+            if self.remaining_requests is not None and self.remaining_requests <= 0:
+                headroom = 0.0
+            latency = self.latency_ms or default_latency_ms
+        # Un déploiement saturé garde une petite chance : sa marge se reconstitue
+        return self.weight * max(headroom, 0.05) / max(latency, 50.0)
+    
+    def record_response(self, response: requests.Response):
+        now = time.monotonic()
+        headers = response.headers
+        with self.lock:
+            self.requests += 1
+            for attribute, header in (('remaining_requests', 'x-ratelimit-remaining-requests'),
+                                      ('remaining_tokens', 'x-ratelimit-remaining-tokens')):
+                try:
+                    setattr(self, attribute, int(headers.get(header)))
+                except (TypeError, ValueError):
+                    pass
+            if self.remaining_tokens is not None:
+                self.max_remaining_tokens = max(self.max_remaining_tokens or 0, self.remaining_tokens)
+            
+            if response.status_code == 429:
+                self.throttled += 1
+                return
+            if response.status_code >= 500:
+                self._failed(now)
+                return
+            self.consecutive_failures = 0
+            self.open_until = 0.0
+            latency = response.elapsed.total_seconds() * 1000
+            self.latency_ms = latency if self.latency_ms is None else 0.7 * self.latency_ms + 0.3 * latency
+            self.recent.append(now)
+            while self.recent and now - self.recent[0] >= 60:
+                self.recent.popleft()
+    
+    def claim(self):
+        """
+        Réserve l'essai d'un disjoncteur à demi ouvert : les autres requêtes
+        l'évitent jusqu'à la réponse (ou la fin d'un nouveau refroidissement)
+        """
+        with self.lock:
+            if self.consecutive_failures >= self.failure_threshold:
+                self.open_until = time.monotonic() + self.cooldown
+    
+    def record_tokens(self, tokens: int):
+        with self.lock:
+            self.tokens += tokens
+    
+    def record_error(self):
+        """
+        Erreur réseau ou délai dépassé
+        """
+        with self.lock:
+            self.requests += 1
+            self._failed(time.monotonic())
+    
+    def _failed(self, now: float):
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            self.open_until = now + self.cooldown
+    
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self.lock:
+            while self.recent and now - self.recent[0] >= 60:
+                self.recent.popleft()
+            return {
+                'name': self.name,
+                'endpoint': self.endpoint,
+                'deployment': self.deployment_name,
+                'weight': self.weight,
+                'circuit': 'closed' if self.consecutive_failures < self.failure_threshold else (
+                    'open' if now < self.open_until else 'half_open'),
+                'requests': self.requests,
+                'failures': self.failures,
+                'throttled': self.throttled,
+                'tokens': self.tokens,
+                'requests_last_minute': len(self.recent),
+                'latency_ms': round(self.latency_ms, 1) if self.latency_ms is not None else None,
+                'remaining_requests': self.remaining_requests,
+                'remaining_tokens': self.remaining_tokens
+            }
+
+class DeploymentPool:
+    """
+    Répartit les requêtes entre plusieurs déploiements servant le même
+    modèle : tirage pondéré par la marge de quota et la latence, parmi les
+    déploiements dont le disjoncteur est fermé et le budget disponible
+    """
+    def __init__(self, deployments: List[Deployment]):
+        if not deployments:
+            raise ValueError("Aucun déploiement Azure AI configuré")
+        self.deployments = deployments
+    
+    @classmethod
+    def from_env(cls) -> 'DeploymentPool':
+        """
+        AZURE_AI_DEPLOYMENTS : liste JSON d'objets {name, endpoint,
+        deployment, api_key, weight, rpm, tpm}. Sans elle, un seul
+        déploiement est construit depuis AZURE_AI_ENDPOINT et AZURE_AI_API_KEY.
+        """
+        api_key = os.getenv('AZURE_AI_API_KEY')
+        deployment_name = os.getenv('AZURE_AI_DEPLOYMENT_NAME', 'gpt-4-vision-preview')
+        failure_threshold = int(os.getenv('AZURE_AI_CIRCUIT_FAILURES', '5'))
+        cooldown = float(os.getenv('AZURE_AI_CIRCUIT_COOLDOWN', '30'))
+        entries = os.getenv('AZURE_AI_DEPLOYMENTS')
+        if entries:
+            try:
+                entries = json.loads(entries)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"AZURE_AI_DEPLOYMENTS invalide: {str(e)}")
+        else:
+            entries = [{
+                'endpoint': os.getenv('AZURE_AI_ENDPOINT'),
+                'rpm': int(os.getenv('AZURE_AI_RPM', '0')),
+                'tpm': int(os.getenv('AZURE_AI_TPM', '0'))
+            }]
+        
+        deployments = []
+        for index, entry in enumerate(entries):
+            endpoint = entry.get('endpoint')
+            key = entry.get('api_key') or api_key
+            if not endpoint or not key:
+                raise ValueError("AZURE_AI_ENDPOINT et AZURE_AI_API_KEY doivent être définis dans .env")
+            name = entry.get('deployment') or deployment_name
+            deployments.append(Deployment(
+                entry.get('name') or (name if len(entries) == 1 else f'{name}-{index + 1}'),
+                endpoint, name, key,
+                weight=float(entry.get('weight', 1)),
+                requests_per_minute=int(entry.get('rpm', 0)),
+                tokens_per_minute=int(entry.get('tpm', 0)),
+                failure_threshold=failure_threshold,
+                cooldown=cooldown
+            ))
+        return cls(deployments)
+    
+    def choose(self, tokens: int, exclude: Iterable[Deployment] = ()) -> Deployment:
+        """
+        Déploiement pour la prochaine requête, en évitant ceux de `exclude`
+        (déjà en échec pour cette requête) tant qu'il en reste d'autres
+        """
+        now = time.monotonic()
+        exclude = set(exclude)
+        candidates = [d for d in self.deployments if d not in exclude and d.available(now)]
+        if not candidates:
+            candidates = [d for d in self.deployments if d.available(now)]
+        if not candidates:
+            # Tous les disjoncteurs sont ouverts : le premier à se refermer
+            chosen = min(self.deployments, key=lambda d: d.open_until)
+            chosen.claim()
+            return chosen
+        
+        waits = {d: d.rate_limiter.wait_time(tokens) for d in candidates}
+        ready = [d for d in candidates if waits[d] <= 0]
+        if not ready:
+            chosen = min(candidates, key=lambda d: waits[d])
+        else:
+            latencies = [d.latency_ms for d in ready if d.latency_ms is not None]
+            default_latency = sum(latencies) / len(latencies) if latencies else 1000.0
+            chosen = random.choices(ready, weights=[d.score(tokens, default_latency) for d in ready])[0]
+        chosen.claim()
+        return chosen
+    
+    def has_alternative(self, exclude: Iterable[Deployment]) -> bool:
+        now = time.monotonic()
+        exclude = set(exclude)
+        return any(d not in exclude and d.available(now) for d in self.deployments)
+    
+    def get(self, name: str) -> Optional[Deployment]:
+        for deployment in self.deployments:
+            if deployment.name == name:
+                return deployment
+        return None
+    
+    def stats(self) -> List[Dict[str, Any]]:
+        return [deployment.stats() for deployment in self.deployments]
+
 class AzureAIProcessor:
     def __init__(self):
-        self.endpoint = os.getenv('AZURE_AI_ENDPOINT')
-        self.api_key = os.getenv('AZURE_AI_API_KEY')
-        self.deployment_name = os.getenv('AZURE_AI_DEPLOYMENT_NAME', 'gpt-4-vision-preview')
+        # Déploiements entre lesquels les requêtes sont réparties (voir DeploymentPool)
+        self.pool = DeploymentPool.from_env()
+        primary = self.pool.deployments[0]
+        self.endpoint = primary.endpoint
+        self.api_key = primary.api_key
+        self.deployment_name = primary.deployment_name
+        # Par défaut, 4 requêtes simultanées par déploiement
+        self.max_workers = int(os.getenv('AZURE_AI_MAX_WORKERS', str(4 * len(self.pool.deployments))))
+        self.max_retries = int(os.getenv('AZURE_AI_MAX_RETRIES', '5'))
+        self.backoff_base = float(os.getenv('AZURE_AI_BACKOFF_BASE', '1'))
+        self.backoff_max = float(os.getenv('AZURE_AI_BACKOFF_MAX', '30'))
+        self.timeout = (
+            float(os.getenv('AZURE_AI_CONNECT_TIMEOUT', '5')),
+            float(os.getenv('AZURE_AI_READ_TIMEOUT', '120'))
+        )
+        self.max_tokens = 1000
+        # Regroupement de plusieurs pages d'un document dans une seule requête
+        self.batch_pages = int(os.getenv('AZURE_AI_BATCH_PAGES', '1'))
+        self.batch_max_bytes = int(os.getenv('AZURE_AI_BATCH_MAX_BYTES', str(15 * 1024 * 1024)))
+        self.batch_result_mode = os.getenv('AZURE_AI_BATCH_RESULT', 'page')
+        self.temperature = 0.7
+        # Mode structuré : réponse JSON imposée, température nulle, validation
+        # du schéma et nouvelle demande limitée aux champs invalides
+        self.structured = os.getenv('AZURE_AI_STRUCTURED', '0') == '1'
+        self.reask_max = int(os.getenv('AZURE_AI_REASK_MAX', '2'))
+        # Mode JSON de l'API (response_format) : pris en charge par gpt-4o,
+        # gpt-4-turbo 2024-04-09 et gpt-35-turbo 1106 et suivants, mais pas
+        # par gpt-4-vision-preview. 'auto' le désactive pour les déploiements
+        # dont le nom contient 'vision-preview'.
+        json_mode = os.getenv('AZURE_AI_JSON_MODE', 'auto')
+        if json_mode == 'auto':
+            self.json_mode = not any('vision-preview' in d.deployment_name for d in self.pool.deployments)
+        else:
+            self.json_mode = json_mode == '1'
+        # Confiance minimale (champ "confiance" de la réponse, s'il est fourni)
+        # en deçà de laquelle une page est relue à pleine résolution
+        self.min_confidence = float(os.getenv('AZURE_AI_MIN_CONFIDENCE', '0.6'))
+        self.cache = create_result_cache()
+        self.deduplicator = PageDeduplicator()
+        
+        # Session partagée : connexions keep-alive réutilisées entre les pages
+        self.pool_size = int(os.getenv('AZURE_AI_POOL_SIZE', str(self.max_workers)))
+        self.session = requests.Session()
+        self.endpoints = list(dict.fromkeys(d.endpoint for d in self.pool.deployments))
+        adapter = HTTPAdapter(pool_connections=len(self.endpoints), pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # Requêtes simultanées tous jobs confondus : chaque job a son pool de
+        # threads, mais les appels ne dépassent jamais le pool de connexions
+        # (pool_size par point de terminaison)
+        self.request_slots = threading.BoundedSemaphore(min(self.max_workers, self.pool_size * len(self.endpoints)))
+    
+    def warm_up(self, connections: int = None) -> int:
+        """
+        Ouvre à l'avance des connexions (DNS, TCP, TLS) vers chaque point de
+        terminaison pour que les premières pages n'en paient pas le coût.
+        Toute réponse HTTP convient ; retourne le nombre de connexions ouvertes.
+        """
+        if connections is None:
+            connections = int(os.getenv('AZURE_AI_WARM_CONNECTIONS', '2'))
+        # Au-delà de la taille du pool, les connexions seraient refermées
+        connections = min(connections, self.pool_size)
+        if connections <= 0:
+            return 0
+        
+        def open_connection(endpoint):
+            try:
+                # Corps lu en entier : la connexion retourne dans le pool
+                self.session.get(endpoint, timeout=self.timeout).content
+                return 1
+            except requests.exceptions.RequestException:
+                return 0
         
-        if not self.endpoint or not self.api_key:
-            raise ValueError("AZURE_AI_ENDPOINT et AZURE_AI_API_KEY doivent être définis dans .env")
+        with span('azure_warm_up'):
+            targets = [endpoint for endpoint in self.endpoints for _ in range(connections)]
+            with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+                return sum(executor.map(open_connection, targets))
     
-    def encode_image_to_base64(self, image_path: str) -> str:
-        """Encode une image en base64"""
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+    def encode_image_to_base64(self, image: Union[str, bytes]) -> str:
+        """Encode une image (chemin ou octets déjà en mémoire) en base64"""
+        with span('base64_encode'):
+            if isinstance(image, (bytes, bytearray, memoryview)):
+                return base64.b64encode(image).decode('utf-8')
+            with open(image, "rb") as image_file:
+                return base64.b64encode(image_file.read()).decode('utf-8')
+    
+    def _image_part(self, image: Union[str, bytes], mime_type: str = None) -> Dict[str, Any]:
+        """Élément image_url d'un message, à partir d'un chemin ou d'octets"""
+        if mime_type is None:
+            mime_type = 'image/png' if isinstance(image, (bytes, bytearray, memoryview)) else self.get_mime_type(image)
+        return {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{mime_type};base64,{self.encode_image_to_base64(image)}"
+            }
+        }
+    
+    def _page_images(self, image_info: Dict[str, Any]) -> List[Union[str, bytes]]:
+        """Images d'une page : octets en mémoire si disponibles, sinon fichiers"""
+        return image_info.get('data') or image_info.get('tiles') or [image_info['path']]
     
     def analyze_image(self, image_path: str, prompt: str) -> Dict[str, Any]:
         """
         Analyse une image avec Azure AI Vision
         """
+        return self.analyze_images([image_path], prompt)
+    
+    def analyze_images(self, images: List[Union[str, bytes]], prompt: str, image_tokens: int = None,
+                       mime_type: str = None) -> Dict[str, Any]:
+        """
+        Analyse plusieurs images (ex: bandes d'une même page) en un seul appel.
+        Chaque image est un chemin de fichier ou ses octets encodés.
+        """
         try:
-            # Encoder l'image en base64
-            base64_image = self.encode_image_to_base64(image_path)
+            content_parts = [
+                {
+                    "type": "text",
+                    "text": prompt
+                }
+            ]
+            for image in images:
+                # Encoder l'image en base64
+                content_parts.append(self._image_part(image, mime_type))
             
-            # Préparer les headers
-            headers = {
-                "Content-Type": "application/json",
-                "api-key": self.api_key
+            if image_tokens is None:
+                image_tokens = IMAGE_TOKEN_ESTIMATE * len(images)
+            estimated_tokens = len(prompt) // 4 + image_tokens + self.max_tokens
+            return self._chat_completion(content_parts, estimated_tokens)
+                
+        except requests.exceptions.RequestException as e:
+            return {
+                'success': False,
+                'error': f'Erreur de requête: {str(e)}'
             }
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f'Erreur lors de l\'analyse: {str(e)}'
+            }
+    
+    def get_mime_type(self, image_path: str) -> str:
+        """Type MIME d'une image d'après son extension"""
+        extension = os.path.splitext(image_path)[1].lower()
+        return MIME_TYPES.get(extension, 'image/png')
+    
+    def analyze_text(self, text: str, prompt: str) -> Dict[str, Any]:
+        """
+        Analyse le texte extrait d'une page (sans image)
+        """
+        try:
+            content_parts = [
+                {
+                    "type": "text",
+                    "text": f"{prompt}\n\nTexte de la page:\n{text}"
+                }
+            ]
             
-            # Préparer le payload
-            payload = {
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": prompt
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/png;base64,{base64_image}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                "max_tokens": 1000,
-                "temperature": 0.7
+            estimated_tokens = (len(prompt) + len(text)) // 4 + self.max_tokens
+            return self._chat_completion(content_parts, estimated_tokens)
+                
+        except requests.exceptions.RequestException as e:
+            return {
+                'success': False,
+                'error': f'Erreur de requête: {str(e)}'
+            }
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f'Erreur lors de l\'analyse: {str(e)}'
             }
+    
+    def _chat_completion(self, content_parts: List[Dict[str, Any]], estimated_tokens: int,
+                         max_tokens: int = None, json_response: bool = None) -> Dict[str, Any]:
+        """
+        Envoie un message utilisateur au déploiement et parse la réponse
+        """
+        # Préparer les headers (la clé dépend du déploiement choisi)
+        headers = {
+            "Content-Type": "application/json"
+        }
+        
+        # Préparer le payload
+        payload = {
+            "messages": [
+                {
+                    "role": "user",
+                    "content": content_parts
+                }
+            ],
+            "max_tokens": max_tokens or self.max_tokens,
+            "temperature": 0 if self.structured else self.temperature
+        }
+        if json_response is None:
+            json_response = self.structured
+        if json_response and self.json_mode:
+            payload["response_format"] = {"type": "json_object"}
+        
+        # Sérialisé une seule fois : sert de clé de cache et de corps de requête
+        with span('json_encode'):
+            body = json.dumps(payload).encode('utf-8')
+        
+        # Un résultat déjà obtenu pour le même contenu, prompt, déploiement
+        # et paramètres est renvoyé sans appel réseau
+        cache_key = None
+        if self.cache is not None:
+            cache_key = ResultCache.make_key(self.deployment_name, body)
+            cached = self.cache.get(cache_key)
+            CACHE_REQUESTS.inc(result='hit' if cached is not None else 'miss')
+            if cached is not None:
+                return dict(cached, cached=True)
+        
+        # Appeler l'API Azure
+        response, timing = self._post_with_retry(headers, body, estimated_tokens)
+        response.raise_for_status()
+        
+        # Parser la réponse
+        result = response.json()
+        usage = result.get('usage') or {}
+        AZURE_TOKENS.inc(usage.get('prompt_tokens', 0), type='prompt')
+        AZURE_TOKENS.inc(usage.get('completion_tokens', 0), type='completion')
+        self.pool.get(timing['deployment']).record_tokens(usage.get('total_tokens', 0))
+        
+        # Extraire le contenu de la réponse
+        if 'choices' in result and len(result['choices']) > 0:
+            content = result['choices'][0]['message']['content']
             
-            # Appeler l'API Azure
-            url = f"{self.endpoint}/openai/deployments/{self.deployment_name}/chat/completions?api-version=2024-02-15-preview"
+            # Essayer de parser comme JSON si possible (y compris dans un bloc ```json)
+            fenced = FENCED_JSON_PATTERN.match(content or '')
+            try:
+                parsed_content = json.loads(fenced.group(1) if fenced else content)
+            except (TypeError, json.JSONDecodeError):
+                # Si ce n'est pas du JSON, retourner le texte brut
+                parsed_content = content
             
-            response = requests.post(url, headers=headers, json=payload)
-            response.raise_for_status()
+            ai_result = {
+                'success': True,
+                'content': parsed_content,
+                'raw_content': content,
+                'usage': result.get('usage', {}),
+                'timing': timing,
+                'cached': False
+            }
+            if cache_key is not None:
+                self.cache.set(cache_key, ai_result)
+            return ai_result
+        else:
+            return {
+                'success': False,
+                'error': 'Aucune réponse valide de l\'API',
+                'raw_response': result,
+                'timing': timing
+            }
+    
+    def analyze_pages(self, images_info: Iterable[Dict[str, Any]], prompt: str,
+                      max_workers: int = None, refine=None, window: int = None) -> Iterator[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """
+        Analyse plusieurs pages en parallèle avec un pool de threads borné.
+        Les pages sont soumises dès qu'elles arrivent et chaque résultat est
+        restitué, dans l'ordre des pages, dès qu'il est prêt. Au plus
+        max_workers × batch_pages + window pages sont en attente : au-delà,
+        la lecture de images_info attend le résultat de la plus ancienne.
+        Si batch_pages > 1, les pages sont regroupées par requête (voir
+        analyze_batch). Les pages blanches et les doublons (voir
+        PageDeduplicator) ne sont pas envoyés.
+        refine(image_info) rend une page à pleine résolution (mode adaptatif,
+        voir analyze_page).
+        """
+        max_workers = max_workers or self.max_workers
+        if window is None:
+            window = int(os.getenv('PDF_PAGE_WINDOW', '4'))
+        max_pending = max_workers * max(1, self.batch_pages) + max(1, window)
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Pages en attente de leur résultat, dans l'ordre : (page, futur, analysée ici)
+            entries = deque()
+            # Pages envoyées dans ce job : (empreinte, futur du résultat)
+            analysed = []
+            # Lot en cours de constitution : [(page, futur de la page)]
+            batch, batch_bytes = [], 0
+            
+            def submit_batch():
+                nonlocal batch, batch_bytes
+                pages = [image_info for image_info, _ in batch]
+                future = executor.submit(self.analyze_batch, pages, prompt, refine)
+                future.add_done_callback(
+                    lambda done, futures=[page_future for _, page_future in batch]: self._settle_batch(done, futures))
+                batch, batch_bytes = [], 0
             
-            # Parser la réponse
-            result = response.json()
+            def next_result():
+                image_info, future, analysed_here = entries.popleft()
+                if not future.done() and any(page_future is future for _, page_future in batch):
+                    # La plus ancienne page attend un lot incomplet : il part tel quel
+                    submit_batch()
+                result = future.result()
+                if analysed_here and image_info.get('fingerprint'):
+                    self.deduplicator.remember(image_info['fingerprint']['hash'], prompt, result)
+                PAGES_PROCESSED.inc(source=result.get('source') or image_info.get('source', 'image'))
+                # Pages blanches ou en double : jamais envoyées
+                image_info.pop('data', None)
+                return image_info, result
             
-            # Extraire le contenu de la réponse
-            if 'choices' in result and len(result['choices']) > 0:
-                content = result['choices'][0]['message']['content']
+            for image_info in images_info:
+                future = self._resolve_duplicate(image_info, prompt, analysed)
+                analysed_here = future is None
+                if analysed_here:
+                    if self.batch_pages > 1:
+                        page_bytes = self._payload_bytes(image_info)
+                        if batch and (len(batch) >= self.batch_pages or batch_bytes + page_bytes > self.batch_max_bytes):
+                            submit_batch()
+                        future = Future()
+                        batch.append((image_info, future))
+                        batch_bytes += page_bytes
+                    else:
+                        future = executor.submit(self.analyze_page, image_info, prompt, refine)
+                    # Octets de la page libérés dès la réponse, sans attendre son tour :
+                    # la mémoire reste bornée par les pages en attente d'envoi
+                    future.add_done_callback(lambda _, image_info=image_info: image_info.pop('data', None))
+                    if image_info.get('fingerprint'):
+                        analysed.append((image_info['fingerprint']['hash'], future))
+                entries.append((image_info, future, analysed_here))
                 
-                # Essayer de parser comme JSON si possible
-                try:
-                    parsed_content = json.loads(content)
-                    return {
-                        'success': True,
-                        'content': parsed_content,
-                        'raw_content': content,
-                        'usage': result.get('usage', {})
-                    }
-                except json.JSONDecodeError:
-                    # Si ce n'est pas du JSON, retourner le texte brut
-                    return {
-                        'success': True,
-                        'content': content,
-                        'raw_content': content,
-                        'usage': result.get('usage', {})
-                    }
+                # Résultats prêts restitués sans attendre la fin du rendu
+                while entries and (entries[0][1].done() or len(entries) >= max_pending):
+                    yield next_result()
+            
+            if batch:
+                submit_batch()
+            while entries:
+                yield next_result()
+    
+    @staticmethod
+    def _settle_batch(done: Future, futures: List[Future]):
+        """
+        Répartit le résultat d'un lot sur les futurs de ses pages
+        """
+        try:
+            results = done.result()
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future, result in zip(futures, results):
+            future.set_result(result)
+    
+    def _resolve_duplicate(self, image_info: Dict[str, Any], prompt: str,
+                           analysed: List[Tuple[str, Future]]) -> Optional[Future]:
+        """
+        Retourne le futur du résultat d'une page blanche ou en double, ou
+        None si la page doit être analysée
+        """
+        fingerprint = image_info.get('fingerprint')
+        if not fingerprint:
+            return None
+        if fingerprint['blank'] and self.deduplicator.skip_blank:
+            return self._resolved(self.deduplicator.blank_result())
+        if not self.deduplicator.enabled:
+            return None
+        
+        # Doublon d'une page déjà envoyée dans ce job
+        for page_hash, original in analysed:
+            near, distance = self.deduplicator.is_near(fingerprint['hash'], page_hash)
+            if near:
+                return self._chained(original, lambda result, distance=distance: self.deduplicator.reuse(result, distance))
+        
+        # Doublon d'une page d'un job précédent
+        result = self.deduplicator.find(fingerprint['hash'], prompt)
+        if result is not None:
+            return self._resolved(result)
+        return None
+    
+    @staticmethod
+    def _resolved(result: Dict[str, Any]) -> Future:
+        future = Future()
+        future.set_result(result)
+        return future
+    
+    @staticmethod
+    def _chained(original: Future, transform) -> Future:
+        """
+        Futur résolu par transform(résultat) quand original se termine
+        """
+        future = Future()
+        
+        def settle(done):
+            try:
+                future.set_result(transform(done.result()))
+            except Exception as e:
+                future.set_exception(e)
+        
+        original.add_done_callback(settle)
+        return future
+    
+    def _payload_bytes(self, image_info: Dict[str, Any]) -> int:
+        """
+        Taille approximative d'une page dans la requête (base64 pour les images)
+        """
+        if image_info.get('text'):
+            return len(image_info['text'].encode('utf-8'))
+        return 4 * -(-image_info.get('size', 0) // 3)
+    
+    def analyze_batch(self, pages: List[Dict[str, Any]], prompt: str, refine=None) -> List[Dict[str, Any]]:
+        """
+        Analyse plusieurs pages d'un même document en une seule requête et
+        retourne un résultat par page. En mode 'page', le modèle renvoie un
+        objet par page ; en mode 'document', un seul objet recopié sur chaque
+        page. Si la réponse reçue ne peut pas être répartie, chaque page est
+        analysée séparément ; une erreur de requête est reportée sur toutes
+        les pages.
+        """
+        if len(pages) == 1:
+            return [self.analyze_page(pages[0], prompt, refine)]
+        
+        page_numbers = [image_info['page'] for image_info in pages]
+        try:
+            content_parts, estimated_tokens = self._pages_content_parts(pages)
+            content_parts.insert(0, {"type": "text", "text": self.build_batch_prompt(prompt, page_numbers, refine is not None)})
+            estimated_tokens += len(prompt) // 4
+            
+            if self.batch_result_mode == 'document':
+                max_tokens = self.max_tokens
             else:
-                return {
-                    'success': False,
-                    'error': 'Aucune réponse valide de l\'API',
-                    'raw_response': result
-                }
-                
+                max_tokens = self.max_tokens * len(pages)
+            # Une réponse groupée est toujours un objet JSON à répartir
+            result = self._chat_completion(content_parts, estimated_tokens + max_tokens, max_tokens, json_response=True)
         except requests.exceptions.RequestException as e:
-            return {
-                'success': False,
-                'error': f'Erreur de requête: {str(e)}'
-            }
+            # Nouvelles tentatives déjà épuisées : renvoyer chaque page
+            # multiplierait les requêtes pendant une panne ou une rafale de 429
+            return [{'success': False, 'error': f'Erreur de requête: {str(e)}'} for _ in pages]
+        except Exception as e:
+            return [{'success': False, 'error': f'Erreur lors de l\'analyse: {str(e)}'} for _ in pages]
+        
+        page_results = self._split_batch_result(result, pages)
+        if page_results is None:
+            # Réponse reçue mais impossible à répartir : une requête par page,
+            # en plus de la requête groupée
+            AZURE_BATCH_FALLBACKS.inc()
+            return [dict(self.analyze_page(image_info, prompt, refine), batch_fallback=True) for image_info in pages]
+        for image_info, page_result in zip(pages, page_results):
+            if not image_info.get('text'):
+                page_result['dpi'] = image_info.get('dpi')
+        if self.structured and self.batch_result_mode == 'document':
+            # Un seul contenu pour tout le document : validé une fois, avec toutes les pages
+            checked = self._ensure_valid(pages, prompt, page_results[0])
+            # Les nouvelles demandes ne sont comptées que sur la première page
+            validation = {key: checked[key] for key in ('content', 'valid', 'validation_errors')}
+            validation['reask_attempts'] = 0
+            page_results = [checked] + [dict(page_result, **validation) for page_result in page_results[1:]]
+        elif self.structured:
+            page_results = [self._ensure_valid([image_info], prompt, page_result)
+                            for image_info, page_result in zip(pages, page_results)]
+        if refine is not None and self.batch_result_mode == 'page':
+            # Seules les pages mal lues sont rendues à nouveau, une par une
+            page_results = [
+                self._refine(image_info, prompt, page_result, refine)
+                if not image_info.get('text') and not self.is_confident(page_result, image_info) else page_result
+                for image_info, page_result in zip(pages, page_results)
+            ]
+        return page_results
+    
+    def _pages_content_parts(self, pages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Éléments de message décrivant plusieurs pages (texte ou images) et
+        estimation de leurs tokens
+        """
+        content_parts = []
+        estimated_tokens = 0
+        for image_info in pages:
+            if image_info.get('text'):
+                content_parts.append({
+                    "type": "text",
+                    "text": f"Page {image_info['page']} (texte extrait):\n{image_info['text']}"
+                })
+                estimated_tokens += len(image_info['text']) // 4
+                continue
+            content_parts.append({"type": "text", "text": f"Page {image_info['page']}:"})
+            for image in self._page_images(image_info):
+                content_parts.append(self._image_part(image, image_info.get('mime_type')))
+            estimated_tokens += image_info.get('preprocessing', {}).get('tokens') or IMAGE_TOKEN_ESTIMATE
+        return content_parts, estimated_tokens
+    
+    def build_batch_prompt(self, prompt: str, page_numbers: List[int], confidence: bool = False) -> str:
+        """
+        Prompt d'extraction pour plusieurs pages d'un même document
+        """
+        pages = ', '.join(str(page_num) for page_num in page_numbers)
+        if self.batch_result_mode == 'document':
+            return (
+                f"Les pages {pages} suivantes appartiennent au même document : "
+                f"lisez-les ensemble (en-tête, totaux...).\n"
+                f"{self.build_structured_prompt(prompt, confidence)}"
+            )
+        return (
+            f"Les pages {pages} suivantes appartiennent au même document : "
+            f"lisez-les ensemble (en-tête, totaux...) mais répondez pour chaque page.\n"
+            f"{self.build_structured_prompt(prompt, confidence)}\n"
+            f"Répondez avec un objet JSON {{\"pages\": [...]}} contenant un objet au format "
+            f"ci-dessus par page, avec en plus le champ \"page\" (numéro de la page)."
+        )
+    
+    def _split_batch_result(self, result: Dict[str, Any], pages: List[Dict[str, Any]]):
+        """
+        Répartit la réponse d'une requête groupée en résultats par page
+        (None si la réponse ne correspond pas au format attendu)
+        """
+        if not result.get('success') or not isinstance(result.get('content'), (dict, list)):
+            return None
+        
+        page_numbers = [image_info['page'] for image_info in pages]
+        shared = {key: value for key, value in result.items() if key not in ('content', 'raw_content', 'usage')}
+        batch = {'pages': page_numbers, 'size': len(pages), 'mode': self.batch_result_mode}
+        
+        if self.batch_result_mode == 'document':
+            if not isinstance(result['content'], dict):
+                return None
+            contents = {page_num: result['content'] for page_num in page_numbers}
+        else:
+            items = result['content']
+            if isinstance(items, dict):
+                items = items.get('pages')
+            if not isinstance(items, list):
+                return None
+            contents = {}
+            for item in items:
+                if isinstance(item, dict) and item.get('page') in page_numbers:
+                    contents[item['page']] = {key: value for key, value in item.items() if key != 'page'}
+            if len(contents) != len(page_numbers):
+                return None
+        
+        page_results = []
+        for index, image_info in enumerate(pages):
+            page_result = dict(shared)
+            page_result.update({
+                'content': contents[image_info['page']],
+                'raw_content': result['raw_content'],
+                # L'usage de la requête est compté une seule fois, sur la première page
+                'usage': result.get('usage', {}) if index == 0 else {},
+                'source': image_info.get('source', 'image'),
+                'batch': batch
+            })
+            page_results.append(page_result)
+        return page_results
+    
+    def analyze_page(self, image_info: Dict[str, Any], prompt: str, refine=None,
+                     structured: bool = None) -> Dict[str, Any]:
+        """
+        Analyse une page par sa couche texte si elle en a une, sinon par son image.
+        Avec refine (mode adaptatif), une image lue à basse résolution dont
+        l'extraction est invalide ou peu sûre est analysée à nouveau à partir
+        de refine(image_info), rendu à pleine résolution.
+        """
+        if structured is None:
+            # Le mode adaptatif a besoin d'une réponse validable
+            structured = self.structured or refine is not None
+        if image_info.get('text'):
+            result = self.extract_structured_data_from_text(image_info['text'], prompt)
+        else:
+            # En mode structuré, l'image reçoit aussi le format JSON attendu
+            image_prompt = self.build_structured_prompt(prompt, refine is not None) if structured else prompt
+            result = self._ask_pages([image_info], image_prompt)
+            result['dpi'] = image_info.get('dpi')
+        
+        if refine is not None and not image_info.get('text') and not self.is_confident(result, image_info):
+            result = self._refine(image_info, prompt, result, refine)
+        if self.structured and 'valid' not in result:
+            # Page jugée sûre, relue (déjà validée) ou relecture impossible :
+            # chaque page porte valid et validation_errors
+            result = self._ensure_valid([image_info], prompt, result)
+        result['source'] = 'text' if image_info.get('text') else 'image'
+        return result
+    
+    def is_confident(self, result: Dict[str, Any], image_info: Dict[str, Any] = None) -> bool:
+        """
+        Lecture suffisante pour ne pas relire la page à pleine résolution :
+        confiance annoncée au moins égale à min_confidence et extraction
+        valide. Une date ou un montant absents ne comptent pas sur une page
+        suivante sans numéro de document (suite d'une facture) : une
+        meilleure résolution n'y ferait pas apparaître de total.
+        """
+        if not result.get('success'):
+            return False
+        content = self.normalize_extraction(result.get('content'))
+        if not isinstance(content, dict):
+            return False
+        confidence = content.get('confiance')
+        if isinstance(confidence, (int, float)) and not isinstance(confidence, bool) and confidence < self.min_confidence:
+            return False
+        
+        errors = self.extraction_errors(content)
+        follow_on = (image_info or {}).get('page', 1) > 1 and not content.get('numero_document')
+        if follow_on:
+            errors = {field: message for field, message in errors.items() if message != 'champ manquant'}
+        return not errors
+    
+    def _refine(self, image_info: Dict[str, Any], prompt: str, result: Dict[str, Any], refine) -> Dict[str, Any]:
+        """
+        Analyse à nouveau une page à partir de son rendu pleine résolution ;
+        le résultat basse résolution est conservé si le rendu échoue
+        """
+        try:
+            refined_info = refine(image_info)
+        except Exception:
+            return result
+        refined = self.analyze_page(refined_info, prompt, structured=True)
+        refined.update({
+            'dpi': refined_info.get('dpi'),
+            'first_pass_dpi': image_info.get('dpi'),
+            'refined': True,
+            # Coût de la première lecture, pour le suivi des tokens
+            'usage_first_pass': result.get('usage', {})
+        })
+        return refined
+    
+    def _ask_pages(self, pages: List[Dict[str, Any]], prompt: str) -> Dict[str, Any]:
+        """
+        Envoie un prompt avec le contenu d'une ou plusieurs pages
+        """
+        if len(pages) == 1 and pages[0].get('text'):
+            return self.analyze_text(pages[0]['text'], prompt)
+        if len(pages) == 1:
+            image_info = pages[0]
+            image_tokens = image_info.get('preprocessing', {}).get('tokens')
+            return self.analyze_images(self._page_images(image_info), prompt, image_tokens,
+                                       image_info.get('mime_type'))
+        try:
+            content_parts, estimated_tokens = self._pages_content_parts(pages)
+            content_parts.insert(0, {"type": "text", "text": prompt})
+            return self._chat_completion(content_parts, len(prompt) // 4 + estimated_tokens + self.max_tokens)
         except Exception as e:
             return {
                 'success': False,
                 'error': f'Erreur lors de l\'analyse: {str(e)}'
             }
     
-    def extract_structured_data(self, image_path: str, extraction_prompt: str) -> Dict[str, Any]:
+    def _ensure_valid(self, pages: List[Dict[str, Any]], prompt: str, result: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Extrait des données structurées d'une image
+        Valide le contenu extrait contre EXTRACTION_SCHEMA et redemande au
+        modèle les seuls champs invalides (au plus reask_max fois). Le
+        résultat porte 'valid', 'validation_errors' et 'reask_attempts'.
+        """
+        if not result.get('success'):
+            # Erreur HTTP : déjà retentée par _post_with_retry
+            return result
+        
+        content = self.normalize_extraction(result.get('content'))
+        errors = self.extraction_errors(content)
+        usage = dict(result.get('usage') or {})
+        attempts = 0
+        # Champs redemandés auxquels le modèle a répondu null : absents du
+        # document (ex: pages suivantes d'une facture), plus redemandés
+        absent = set()
+        while errors and attempts < self.reask_max:
+            attempts += 1
+            AZURE_REASKS.inc()
+            partial = isinstance(content, dict)
+            reask = self._ask_pages(pages, self.build_reask_prompt(prompt, errors if partial else None))
+            for key, value in (reask.get('usage') or {}).items():
+                usage[key] = usage.get(key, 0) + value
+            if not reask.get('success'):
+                break
+            
+            answer = self.normalize_extraction(reask.get('content'))
+            if partial and isinstance(answer, dict):
+                absent.update(field for field in errors if field in answer and answer[field] in (None, ''))
+                # Seuls les champs redemandés remplacent ceux de la première réponse
+                content = dict(content, **{field: answer[field] for field in errors
+                                           if field in answer and field not in absent})
+            elif isinstance(answer, dict):
+                content = answer
+            errors = {field: message for field, message in self.extraction_errors(content).items()
+                      if field not in absent}
+        
+        checked = dict(result, content=content, usage=usage, valid=not errors,
+                       validation_errors=errors, reask_attempts=attempts)
+        if absent:
+            checked['absent_fields'] = sorted(absent)
+        return checked
+    
+    def build_reask_prompt(self, prompt: str, errors: Dict[str, str] = None) -> str:
+        """
+        Prompt de correction : toute la réponse si elle n'était pas un JSON
+        valide, sinon uniquement les champs en erreur
+        """
+        if errors is None:
+            return (
+                f"{self.build_structured_prompt(prompt)}\n"
+                f"Votre réponse précédente n'était pas un objet JSON valide. "
+                f"Répondez uniquement avec l'objet JSON, sans texte autour."
+            )
+        details = '\n'.join(f"- {field}: {message}" for field, message in errors.items())
+        fields = ', '.join(f'"{field}"' for field in errors)
+        return (
+            f"{prompt}\n\n"
+            f"Dans votre réponse précédente, les champs suivants étaient manquants ou invalides :\n"
+            f"{details}\n"
+            f"Relisez le document et répondez uniquement avec un objet JSON contenant les champs {fields}. "
+            f"Les dates sont au format YYYY-MM-DD et les montants sont des nombres. "
+            f"Utilisez null si l'information n'apparaît pas dans le document."
+        )
+    
+    def _post_with_retry(self, headers: Dict[str, str], body: bytes,
+                         estimated_tokens: int) -> Tuple[requests.Response, Dict[str, Any]]:
+        """
+        Envoie la requête via la session partagée, à un déploiement du pool
+        choisi dans son budget RPM/TPM. Réessaie les erreurs réseau, les 5xx
+        et les 429 avec un backoff exponentiel à jitter (Retry-After est
+        prioritaire sur les 429) ; s'il reste un autre déploiement disponible,
+        la requête y bascule immédiatement, sans attendre.
+        Retourne la réponse et le détail des temps de l'appel.
+        """
+        started = time.perf_counter()
+        attempt = 0
+        # Déploiements ayant échoué pour cette requête
+        failed = set()
+        while True:
+            deployment = self.pool.choose(estimated_tokens, exclude=failed)
+            deployment.rate_limiter.acquire(estimated_tokens)
+            try:
+                AZURE_BYTES_UPLOADED.inc(len(body))
+                with self.request_slots, span('azure_request'):
+                    response = self.session.post(deployment.url, headers=dict(headers, **{'api-key': deployment.api_key}),
+                                                 data=body, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                AZURE_REQUESTS.inc(status=type(e).__name__)
+                AZURE_DEPLOYMENT_REQUESTS.inc(deployment=deployment.name, status=type(e).__name__)
+                deployment.record_error()
+                if attempt >= self.max_retries:
+                    raise
+                failed.add(deployment)
+                if not self.pool.has_alternative(failed):
+                    time.sleep(self._backoff_delay(attempt))
+                attempt += 1
+                AZURE_RETRIES.inc()
+                continue
+            AZURE_REQUESTS.inc(status=response.status_code)
+            AZURE_DEPLOYMENT_REQUESTS.inc(deployment=deployment.name, status=response.status_code)
+            deployment.record_response(response)
+            
+            retryable = response.status_code == 429 or response.status_code >= 500
+            if not retryable or attempt >= self.max_retries:
+                break
+            
+            failed.add(deployment)
+            delay = self._backoff_delay(attempt)
+            if response.status_code == 429:
+                try:
+                    delay = float(response.headers.get('Retry-After'))
+                except (TypeError, ValueError):
+                    pass
+                # Le quota est partagé : tous les threads attendent ce déploiement
+                deployment.rate_limiter.pause(delay)
+            elif not self.pool.has_alternative(failed):
+                time.sleep(delay)
+            attempt += 1
+            AZURE_RETRIES.inc()
+        
+        total_ms = (time.perf_counter() - started) * 1000
+        ttfb_ms = response.elapsed.total_seconds() * 1000
+        try:
+            model_ms = float(response.headers.get('openai-processing-ms'))
+        except (TypeError, ValueError):
+            model_ms = None
+        
+        timing = {
+            'deployment': deployment.name,
+            'attempts': attempt + 1,
+            'total_ms': round(total_ms, 1),
+            # Temps jusqu'aux en-têtes de la dernière tentative (connexion + modèle)
+            'ttfb_ms': round(ttfb_ms, 1),
+            # Temps de traitement déclaré par Azure
+            'model_ms': model_ms,
+            # Connexion, TLS, upload et file d'attente côté réseau
+            'overhead_ms': round(ttfb_ms - model_ms, 1) if model_ms is not None else None
+        }
+        return response, timing
+    
+    def _backoff_delay(self, attempt: int) -> float:
+        """
+        Backoff exponentiel avec jitter complet
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+    
+    def build_structured_prompt(self, extraction_prompt: str, confidence: bool = False) -> str:
+        """
+        Ajoute au prompt le format JSON attendu pour l'extraction. Avec
+        confidence (mode adaptatif), le modèle indique aussi sa confiance
+        dans la lecture, qui décide d'une relecture à pleine résolution.
         """
-        structured_prompt = f"""
+        confidence_field = '\n            "confiance": "number (0 à 1, lisibilité du document)",' if confidence else ''
+        return f"""
         {extraction_prompt}
         
         Veuillez répondre avec un JSON structuré contenant les informations extraites.
@@ -122,12 +1130,65 @@ class AzureAIProcessor:
             "devise": "string",
             "emetteur": "string",
             "destinataire": "string",
-            "numero_document": "string",
+            "numero_document": "string",{confidence_field}
             "autres_informations": {{}}
         }}
         """
+    
+    def extract_structured_data(self, image_path: str, extraction_prompt: str) -> Dict[str, Any]:
+        """
+        Extrait des données structurées d'une image
+        """
+        return self.analyze_image(image_path, self.build_structured_prompt(extraction_prompt))
+    
+    def extract_structured_data_from_text(self, text: str, extraction_prompt: str) -> Dict[str, Any]:
+        """
+        Extrait des données structurées de la couche texte d'une page
+        """
+        return self.analyze_text(text, self.build_structured_prompt(extraction_prompt))
+    
+    def normalize_extraction(self, content: Any) -> Any:
+        """
+        Corrige les écarts de forme courants avant validation (montant
+        en texte avec virgule décimale ou séparateur de milliers)
+        """
+        if not isinstance(content, dict):
+            return content
+        amount = content.get('montant')
+        if isinstance(amount, str):
+            cleaned = amount.replace('\u00a0', '').replace(' ', '')
+            if ',' in cleaned and '.' in cleaned:
+                cleaned = cleaned.replace('.', '') if cleaned.rfind(',') > cleaned.rfind('.') else cleaned.replace(',', '')
+            try:
+                content = dict(content, montant=float(cleaned.replace(',', '.')))
+            except ValueError:
+                pass
+        return content
+    
+    def extraction_errors(self, content: Any) -> Dict[str, str]:
+        """
+        Champs manquants ou invalides par rapport à EXTRACTION_SCHEMA
+        (champ -> message), vide si le contenu est conforme
+        """
+        if not isinstance(content, dict):
+            return {field: 'réponse non JSON' for field, (_, required) in EXTRACTION_SCHEMA.items() if required}
         
-        return self.analyze_image(image_path, structured_prompt)
+        errors = {}
+        for field, (expected, required) in EXTRACTION_SCHEMA.items():
+            value = content.get(field)
+            if value is None or value == '':
+                if required:
+                    errors[field] = 'champ manquant'
+                continue
+            if expected == 'number' and (isinstance(value, bool) or not isinstance(value, (int, float))):
+                errors[field] = 'nombre attendu'
+            elif expected == 'date' and not (isinstance(value, str) and DATE_PATTERN.match(value)):
+                errors[field] = 'date au format YYYY-MM-DD attendue'
+            elif expected == 'string' and not isinstance(value, str):
+                errors[field] = 'texte attendu'
+            elif expected == 'object' and not isinstance(value, dict):
+                errors[field] = 'objet attendu'
+        return errors
     
     def validate_extraction_result(self, result: Dict[str, Any]) -> bool:
         """
@@ -136,12 +1197,4 @@ class AzureAIProcessor:
         if not result.get('success', False):
             return False
         
-        content = result.get('content', {})
-        
-        # Vérifier si c'est un dictionnaire
-        if not isinstance(content, dict):
-            return False
-        
-        # Vérifier les champs requis (à adapter selon vos besoins)
-        required_fields = ['type_document', 'date', 'montant']
-        return all(field in content for field in required_fields) 
\ No newline at end of file
+        return not self.extraction_errors(self.normalize_extraction(result.get('content', {})))
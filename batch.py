@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Traitement par lots d'un répertoire de factures PDF, sans serveur web.
+
+Le rendu des pages (poppler + encodage des images) est réparti sur un pool
+de processus ; l'analyse Azure AI passe par un client unique, limité en débit.
+Le lot reprend là où il s'était arrêté grâce à un fichier de reprise.
+
+Exemples:
+    python batch.py /partage/factures --output-dir output
+    python batch.py "/partage/factures/2024-*.pdf" --per-document --render-workers 8
+"""
+
+import os
+import sys
+import glob
+import json
+import hashlib
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+DEFAULT_PROMPT = 'Analysez cette image et extrayez les informations importantes'
+
+def collect_pdf_paths(inputs):
+    """
+    Résout les répertoires et motifs glob en une liste triée de PDF
+    """
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            candidates = glob.glob(os.path.join(item, '**', '*'), recursive=True)
+        else:
+            candidates = glob.glob(item, recursive=True)
+        paths.update(
+            os.path.abspath(path) for path in candidates
+            if os.path.isfile(path) and path.lower().endswith('.pdf')
+        )
+    return sorted(paths)
+
+def document_folder(images_folder, pdf_path):
+    """
+    Sous-dossier d'images d'un document (évite les collisions de noms)
+    """
+    path_hash = hashlib.sha1(pdf_path.encode('utf-8')).hexdigest()[:8]
+    return os.path.join(images_folder, f"{os.path.splitext(os.path.basename(pdf_path))[0]}_{path_hash}")
+
+def render_document(pdf_path, images_folder, text_first):
+    """
+    Rend toutes les pages d'un document (exécuté dans un processus du pool)
+    """
+    from pdf_processor import PDFProcessor
+    
+    started = time.perf_counter()
+    # Le parallélisme est déjà assuré par le pool : un seul pdftoppm par document
+    pdf_processor = PDFProcessor(render_workers=1)
+    pages = list(pdf_processor.iter_pdf_pages(pdf_path, document_folder(images_folder, pdf_path), text_first=text_first))
+    if pdf_processor.page_writer is not None:
+        # Les aperçus doivent être écrits avant que le processus ne rende la main
+        pdf_processor.page_writer.flush()
+    return pages, time.perf_counter() - started
+
+def load_checkpoint(checkpoint_path):
+    """
+    Retourne les résultats déjà obtenus, indexés par chemin de PDF
+    """
+    done = {}
+    if not os.path.exists(checkpoint_path):
+        return done
+    with open(checkpoint_path, encoding='utf-8') as checkpoint_file:
+        for line in checkpoint_file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Dernière ligne tronquée par un arrêt brutal
+                continue
+            done[entry['pdf_path']] = entry
+    return done
+
+def append_checkpoint(checkpoint_path, entry):
+    with open(checkpoint_path, 'a', encoding='utf-8') as checkpoint_file:
+        checkpoint_file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse par lots de factures PDF avec Azure AI")
+    parser.add_argument('inputs', nargs='+', help='Répertoires ou motifs glob de fichiers PDF')
+    parser.add_argument('--output-dir', default='output', help='Dossier des classeurs générés')
+    parser.add_argument('--images-dir', default='images', help='Dossier des images rendues')
+    parser.add_argument('--excel', help='Classeur existant à compléter (sinon un nouveau est créé)')
+    parser.add_argument('--per-document', action='store_true', help='Un classeur par document au lieu d\'un classeur consolidé')
+    parser.add_argument('--checkpoint', help='Fichier de reprise (défaut: <output-dir>/batch_checkpoint.jsonl)')
+    parser.add_argument('--render-workers', type=int, default=os.cpu_count(), help='Processus de rendu')
+    parser.add_argument('--prompt', default=DEFAULT_PROMPT, help='Prompt d\'analyse')
+    parser.add_argument('--no-text-first', action='store_true', help='Toujours analyser les pages comme des images')
+    args = parser.parse_args()
+    
+    from azure_ai_processor import AzureAIProcessor
+    from excel_processor import ExcelProcessor
+    from pdf_processor import PDFProcessor
+    
+    os.makedirs(args.output_dir, exist_ok=True)
+    checkpoint_path = args.checkpoint or os.path.join(args.output_dir, 'batch_checkpoint.jsonl')
+    
+    pdf_paths = collect_pdf_paths(args.inputs)
+    if not pdf_paths:
+        print("❌ Aucun fichier PDF trouvé")
+        sys.exit(1)
+    
+    done = load_checkpoint(checkpoint_path)
+    pending = [path for path in pdf_paths if path not in done]
+    print(f"📄 {len(pdf_paths)} documents, {len(done)} déjà traités, {len(pending)} à traiter")
+    
+    # Client unique : pool HTTP, budget RPM/TPM et cache partagés par tout le lot
+    azure_processor = AzureAIProcessor()
+    excel_processor = ExcelProcessor()
+    excel_path = args.excel or ''
+    # Second rendu pleine résolution du mode adaptatif (PDF_ADAPTIVE_DPI)
+    refiner = PDFProcessor(render_workers=1)
+    
+    started = time.perf_counter()
+    render_seconds = 0.0
+    pages = 0
+    failures = 0
+    errors = 0
+    
+    with ProcessPoolExecutor(max_workers=args.render_workers) as executor:
+        # Rendus en cours ou terminés en attente d'analyse : bornés pour que les
+        # pages rendues ne s'accumulent pas quand Azure est plus lent que le rendu
+        max_in_flight = args.render_workers + 1
+        to_render = iter(pending)
+        futures = {}
+        
+        def submit_renders():
+            while len(futures) < max_in_flight:
+                pdf_path = next(to_render, None)
+                if pdf_path is None:
+                    return
+                futures[executor.submit(render_document, pdf_path, args.images_dir, not args.no_text_first)] = pdf_path
+        
+        submit_renders()
+        # Les documents sont analysés dans l'ordre où leur rendu se termine
+        while futures:
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            future = next(iter(finished))
+            pdf_path = futures.pop(future)
+            submit_renders()
+            try:
+                images_info, render_time = future.result()
+            except Exception as e:
+                errors += 1
+                print(f"❌ {pdf_path}: {e}")
+                continue
+            render_seconds += render_time
+            
+            results = []
+            refine = None
+            if refiner.adaptive_dpi:
+                refine = lambda image_info, pdf_path=pdf_path: refiner.refine_page(
+                    pdf_path, image_info, document_folder(args.images_dir, pdf_path))
+            for image_info, ai_result in azure_processor.analyze_pages(images_info, args.prompt, refine=refine):
+                results.append({
+                    'page': image_info['page'],
+                    'image_path': image_info['path'],
+                    'source': image_info.get('source', 'image'),
+                    'ai_result': ai_result
+                })
+            document_failures = sum(1 for result in results if not result['ai_result'].get('success'))
+            
+            entry = {'pdf_path': pdf_path, 'results': results}
+            if args.per_document:
+                # Même nommage que les images : a/facture.pdf et b/facture.pdf ne s'écrasent pas
+                name = os.path.basename(document_folder(args.output_dir, pdf_path))
+                entry['output_excel'] = excel_processor.update_excel_with_results(
+                    excel_path, results, os.path.join(args.output_dir, f'{name}_resultat.xlsx'))
+            if not document_failures:
+                # Un document avec des pages en échec n'est pas marqué comme
+                # traité : il est repris à la prochaine exécution
+                append_checkpoint(checkpoint_path, entry)
+            done[pdf_path] = entry
+            
+            pages += len(results)
+            failures += document_failures
+            print(f"✅ {os.path.basename(pdf_path)}: {len(results)} pages"
+                  + (f", {document_failures} en erreur (repris à la prochaine exécution)" if document_failures else ""))
+    
+    if not args.per_document:
+        # Le classeur consolidé reprend aussi les documents des exécutions précédentes
+        consolidated_path = os.path.join(args.output_dir, 'resultat_lot.xlsx')
+        all_results = (
+            result
+            for pdf_path in pdf_paths if pdf_path in done
+            for result in done[pdf_path]['results']
+        )
+        excel_processor.export_results_streaming(all_results, consolidated_path, excel_path)
+        print(f"📊 Classeur consolidé: {consolidated_path}")
+    
+    elapsed = time.perf_counter() - started
+    print("=" * 60)
+    print(f"Documents traités : {len(pending) - errors} (erreurs: {errors})")
+    print(f"Pages analysées   : {pages} (échecs d'analyse: {failures})")
+    print(f"Durée totale      : {elapsed:.1f} s (rendu cumulé: {render_seconds:.1f} s)")
+    if elapsed:
+        print(f"Débit             : {pages / elapsed:.2f} pages/s, {(len(pending) - errors) / elapsed * 3600:.0f} documents/h")
+    if azure_processor.cache is not None:
+        print(f"Cache             : {azure_processor.cache.stats()}")
+    
+    if errors:
+        sys.exit(2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Banc d'essai hors ligne du pipeline PDF -> Azure AI -> Excel.
+Un faux endpoint Azure OpenAI local remplace le vrai service : aucun quota consommé.
+
+Exemple:
+    python benchmark.py --pages 20 --documents 3 --latency-ms 800 --error-rate 0.05 --output bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import resource
+import argparse
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image, ImageDraw
+
+class MockAzureHandler(BaseHTTPRequestHandler):
+    """
+    Imite /openai/deployments/{name}/chat/completions avec latence,
+    erreurs 5xx et réponses 429 configurables
+    """
+    protocol_version = 'HTTP/1.1'
+    
+    def do_POST(self):
+        config = self.server.config
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        
+        if '/openai/deployments/' not in self.path or '/chat/completions' not in self.path:
+            self._send(404, {'error': {'message': 'Not found'}})
+            return
+        
+        with self.server.lock:
+            self.server.request_count += 1
+        
+        roll = random.random()
+        if roll < config['rate_limit_rate']:
+            self._send(429, {'error': {'code': '429', 'message': 'Rate limit'}},
+                       {'Retry-After': str(config['retry_after'])})
+            return
+        if roll < config['rate_limit_rate'] + config['error_rate']:
+            self._send(500, {'error': {'message': 'Erreur simulée'}})
+            return
+        
+        latency = max(0.0, random.gauss(config['latency_ms'], config['jitter_ms'])) / 1000
+        time.sleep(latency)
+        
+        content = json.dumps({
+            'type_document': 'facture',
+            'date': '2024-01-31',
+            'montant': round(random.uniform(10, 5000), 2),
+            'devise': 'EUR',
+            'emetteur': 'Fournisseur Test',
+            'destinataire': 'Client Test',
+            'numero_document': f'F-{random.randint(1000, 9999)}',
+            'autres_informations': {}
+        })
+        self._send(200, {
+            'choices': [{'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': 900, 'completion_tokens': 120, 'total_tokens': 1020}
+        }, {'openai-processing-ms': str(round(latency * 1000, 1))})
+    
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def log_message(self, format, *args):
+        pass
+
+class MockAzureServer:
+    """
+    Serveur local lancé dans un thread, à utiliser comme gestionnaire de contexte
+    """
+    def __init__(self, latency_ms=500, jitter_ms=100, error_rate=0.0, rate_limit_rate=0.0, retry_after=1):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), MockAzureHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.lock = threading.Lock()
+        self.httpd.request_count = 0
+        self.httpd.config = {
+            'latency_ms': latency_ms,
+            'jitter_ms': jitter_ms,
+            'error_rate': error_rate,
+            'rate_limit_rate': rate_limit_rate,
+            'retry_after': retry_after
+        }
+    
+    @property
+    def endpoint(self):
+        return f'http://127.0.0.1:{self.httpd.server_address[1]}'
+    
+    @property
+    def request_count(self):
+        return self.httpd.request_count
+    
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+    
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def generate_invoice_pdf(path, pages, seed=0):
+    """
+    Génère une facture synthétique scannée (sans couche texte) de `pages` pages
+    """
+    rng = random.Random(seed)
+    images = []
+    for page_num in range(1, pages + 1):
+        image = Image.new('RGB', (1240, 1754), 'white')
+        draw = ImageDraw.Draw(image)
+        draw.text((100, 100), f'FACTURE N° F-{rng.randint(1000, 9999)}  -  Page {page_num}/{pages}', fill='black')
+        draw.text((100, 140), 'Fournisseur Test - 1 rue de la Paix, 75000 Paris', fill='black')
+        for line in range(40):
+            y = 220 + line * 35
+            draw.text((100, y), f'Article {line + 1:03d}   Quantité {rng.randint(1, 20):3d}', fill='black')
+            draw.text((900, y), f'{rng.uniform(1, 500):10.2f} EUR', fill='black')
+        if page_num == pages:
+            draw.text((900, 1650), f'TOTAL {rng.uniform(1000, 9000):.2f} EUR', fill='black')
+        images.append(image)
+    images[0].save(path, 'PDF', resolution=150, save_all=True, append_images=images[1:])
+    return path
+
+def percentiles(values):
+    """
+    p50 / p95 / p99 (en millisecondes) d'une série de mesures
+    """
+    if not values:
+        return {'count': 0, 'p50': None, 'p95': None, 'p99': None}
+    ordered = sorted(values)
+    
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))], 1)
+    
+    return {'count': len(ordered), 'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99)}
+
+def peak_rss_mb():
+    """
+    Pic de mémoire résidente du processus (ru_maxrss est en Ko sous Linux, en octets sous macOS)
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(peak / divisor, 1)
+
+def run_direct(pdf_paths, workdir, prompt):
+    """
+    Enchaîne PDFProcessor, AzureAIProcessor et ExcelProcessor sans passer par Flask
+    """
+    from pdf_processor import PDFProcessor
+    from azure_ai_processor import AzureAIProcessor
+    from excel_processor import ExcelProcessor
+    
+    pdf_processor = PDFProcessor()
+    azure_processor = AzureAIProcessor()
+    excel_processor = ExcelProcessor()
+    images_folder = os.path.join(workdir, 'images')
+    excel_path = excel_processor.create_template_excel(os.path.join(workdir, 'template.xlsx'))
+    
+    stages = {'render': [], 'azure': [], 'excel': [], 'document': []}
+    pages = 0
+    failures = 0
+    started = time.perf_counter()
+    
+    for pdf_path in pdf_paths:
+        document_started = time.perf_counter()
+        results = []
+        pages_iter = pdf_processor.prefetch_pages(pdf_path, images_folder)
+        for image_info, ai_result in azure_processor.analyze_pages(pages_iter, prompt):
+            # Mesuré par le rendu lui-même : l'écart entre deux pages inclut
+            # l'attente des réponses Azure quand la fenêtre est pleine
+            render_ms = image_info.get('timing', {}).get('pdf_render_ms')
+            if render_ms is not None:
+                stages['render'].append(render_ms)
+            if ai_result.get('timing'):
+                stages['azure'].append(ai_result['timing']['total_ms'])
+            if not ai_result.get('success'):
+                failures += 1
+            results.append({'page': image_info['page'], 'image_path': image_info['path'], 'ai_result': ai_result})
+        
+        excel_started = time.perf_counter()
+        output_path = os.path.join(workdir, f'{os.path.basename(pdf_path)}.xlsx')
+        excel_processor.update_excel_with_results(excel_path, results, output_path)
+        stages['excel'].append((time.perf_counter() - excel_started) * 1000)
+        stages['document'].append((time.perf_counter() - document_started) * 1000)
+        pages += len(results)
+    
+    elapsed = time.perf_counter() - started
+    return {
+        'pages': pages,
+        'failures': failures,
+        'elapsed_s': round(elapsed, 3),
+        'pages_per_s': round(pages / elapsed, 3) if elapsed else None,
+        'stages_ms': {name: percentiles(values) for name, values in stages.items()}
+    }
+
+def run_flask(pdf_paths, workdir, prompt):
+    """
+    Passe par les routes /upload et /process de l'application Flask
+    """
+    from app import app
+    from excel_processor import ExcelProcessor
+    
+    client = app.test_client()
+    excel_path = ExcelProcessor().create_template_excel(os.path.join(workdir, 'template_flask.xlsx'))
+    
+    stages = {'upload': [], 'process': []}
+    pages = 0
+    failures = 0
+    started = time.perf_counter()
+    
+    for pdf_path in pdf_paths:
+        upload_started = time.perf_counter()
+        with open(pdf_path, 'rb') as pdf_file, open(excel_path, 'rb') as excel_file:
+            response = client.post('/upload', data={
+                'pdf_file': (pdf_file, os.path.basename(pdf_path)),
+                'excel_file': (excel_file, 'template.xlsx')
+            }, content_type='multipart/form-data')
+        stages['upload'].append((time.perf_counter() - upload_started) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f"Upload échoué: {response.get_json()}")
+        uploaded = response.get_json()
+        
+        process_started = time.perf_counter()
+        response = client.post('/process', json={
+            'upload_id': uploaded['upload_id'],
+            'prompt': prompt
+        })
+        if response.status_code >= 400:
+            raise RuntimeError(f"Traitement échoué: {response.get_json()}")
+        payload = response.get_json()
+        
+        # /process est asynchrone : attendre la fin du job
+        if 'job_id' in payload:
+            while True:
+                response = client.get(payload['result_url'])
+                if response.status_code != 202:
+                    break
+                time.sleep(0.05)
+            payload = response.get_json()
+            if response.status_code != 200:
+                raise RuntimeError(f"Traitement échoué: {payload}")
+        stages['process'].append((time.perf_counter() - process_started) * 1000)
+        
+        results = payload.get('results', [])
+        pages += len(results)
+        failures += sum(1 for result in results if not result['ai_result'].get('success'))
+    
+    elapsed = time.perf_counter() - started
+    return {
+        'pages': pages,
+        'failures': failures,
+        'elapsed_s': round(elapsed, 3),
+        'pages_per_s': round(pages / elapsed, 3) if elapsed else None,
+        'stages_ms': {name: percentiles(values) for name, values in stages.items()}
+    }
+
+def compare(report, baseline):
+    """
+    Écart de débit par mode par rapport à un rapport précédent
+    """
+    deltas = {}
+    for mode, current in report['modes'].items():
+        previous = baseline.get('modes', {}).get(mode)
+        if previous and previous.get('pages_per_s') and current.get('pages_per_s'):
+            change = (current['pages_per_s'] - previous['pages_per_s']) / previous['pages_per_s']
+            deltas[mode] = {
+                'pages_per_s': current['pages_per_s'],
+                'baseline_pages_per_s': previous['pages_per_s'],
+                'change_pct': round(change * 100, 1)
+            }
+    return deltas
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc d'essai hors ligne du pipeline d'analyse PDF")
+    parser.add_argument('--pages', type=int, default=10, help='Pages par document')
+    parser.add_argument('--documents', type=int, default=2, help='Nombre de documents')
+    parser.add_argument('--latency-ms', type=float, default=500, help='Latence moyenne du faux Azure')
+    parser.add_argument('--jitter-ms', type=float, default=100, help='Écart type de la latence')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Proportion de réponses 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Proportion de réponses 429')
+    parser.add_argument('--retry-after', type=float, default=1, help='Valeur de Retry-After sur les 429')
+    parser.add_argument('--mode', choices=['direct', 'flask', 'both'], default='both')
+    parser.add_argument('--output', help='Fichier JSON de résultats')
+    parser.add_argument('--baseline', help='Rapport JSON précédent à comparer')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    
+    random.seed(args.seed)
+    prompt = 'Analysez cette image et extrayez les informations importantes'
+    
+    with tempfile.TemporaryDirectory() as workdir, MockAzureServer(
+            latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after) as server:
+        # Le client Azure pointe vers le faux serveur, y compris si .env définit
+        # un pool de déploiements ; pas de cache entre les runs. Les valeurs
+        # sont fixées plutôt que supprimées : load_dotenv() (à l'import de
+        # azure_ai_processor) ne remplace pas une variable déjà définie.
+        os.environ.update({
+            'AZURE_AI_DEPLOYMENTS': json.dumps([{
+                'name': 'benchmark', 'endpoint': server.endpoint, 'deployment': 'benchmark', 'api_key': 'benchmark'
+            }]),
+            'AZURE_AI_ENDPOINT': server.endpoint,
+            'AZURE_AI_API_KEY': 'benchmark',
+            'AZURE_AI_DEPLOYMENT_NAME': 'benchmark',
+            'AZURE_AI_CACHE': 'none',
+            # Réglages qui changent les requêtes envoyées ou leur cadence
+            'AZURE_AI_STRUCTURED': '0',
+            'AZURE_AI_RPM': '0',
+            'AZURE_AI_TPM': '0',
+            # Le faux serveur répond une facture par requête : ni pages groupées,
+            # ni pages sautées (doublons, pages blanches), ni second rendu
+            'AZURE_AI_BATCH_PAGES': '1',
+            'DEDUP_ENABLED': '0',
+            'DEDUP_SKIP_BLANK': '0',
+            'PDF_ADAPTIVE_DPI': '0'
+        })
+        
+        pdf_paths = [
+            generate_invoice_pdf(os.path.join(workdir, f'facture_{index:03d}.pdf'), args.pages, seed=args.seed + index)
+            for index in range(args.documents)
+        ]
+        
+        # L'application écrit uploads/, images/ et output/ dans le répertoire courant
+        previous_cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            report = {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'config': vars(args),
+                'modes': {}
+            }
+            if args.mode in ('direct', 'both'):
+                report['modes']['direct'] = run_direct(pdf_paths, workdir, prompt)
+            if args.mode in ('flask', 'both'):
+                report['modes']['flask'] = run_flask(pdf_paths, workdir, prompt)
+            report['mock_requests'] = server.request_count
+            report['peak_rss_mb'] = peak_rss_mb()
+        finally:
+            # Le dossier temporaire ne peut pas être supprimé tant qu'il est courant
+            os.chdir(previous_cwd)
+    
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            report['comparison'] = compare(report, json.load(baseline_file))
+    
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            output_file.write(output)
+    print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+import os
+import re
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Any, Optional, List, BinaryIO
+from werkzeug.utils import secure_filename
+
+# Les PDF linéarisés annoncent leur nombre de pages (/N) dans le premier Ko
+LINEARIZED_PAGES_PATTERN = re.compile(rb'/Linearized\b.*?/N\s+(\d+)', re.DOTALL)
+
+class UploadError(Exception):
+    """
+    Envoi refusé, avec le code HTTP à renvoyer au client
+    """
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+class UploadIndex:
+    """
+    Empreintes SHA-256 des fichiers reçus et jobs lancés sur chacun, pour
+    reconnaître un fichier déjà envoyé sans le relire
+    """
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv('UPLOAD_INDEX_PATH', os.path.join('cache', 'uploads.sqlite'))
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS uploads ('
+            'path TEXT PRIMARY KEY, sha256 TEXT NOT NULL, filename TEXT, size INTEGER, created_at REAL NOT NULL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_uploads_sha256 ON uploads (sha256)')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS upload_jobs ('
+            'sha256 TEXT NOT NULL, job_id TEXT NOT NULL, created_at REAL NOT NULL, PRIMARY KEY (sha256, job_id))'
+        )
+        self.conn.commit()
+    
+    def add(self, path: str, sha256: str, size: int):
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO uploads (path, sha256, filename, size, created_at) VALUES (?, ?, ?, ?, ?)',
+                (os.path.abspath(path), sha256, os.path.basename(path), size, time.time())
+            )
+            self.conn.commit()
+    
+    def find(self, sha256: str) -> Optional[str]:
+        """
+        Chemin d'un fichier encore présent ayant cette empreinte
+        """
+        with self.lock:
+            paths = [row[0] for row in self.conn.execute('SELECT path FROM uploads WHERE sha256 = ?', (sha256,))]
+            for path in paths:
+                if os.path.exists(path):
+                    return path
+                # Fichier évincé par la rétention
+                self.conn.execute('DELETE FROM uploads WHERE path = ?', (path,))
+            self.conn.commit()
+        return None
+    
+    def link_job(self, path: str, job_id: str):
+        """
+        Associe un job au contenu du fichier traité
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT sha256 FROM uploads WHERE path = ?', (os.path.abspath(path),)).fetchone()
+            if row is None:
+                return
+            self.conn.execute(
+                'INSERT OR IGNORE INTO upload_jobs (sha256, job_id, created_at) VALUES (?, ?, ?)',
+                (row[0], job_id, time.time())
+            )
+            self.conn.commit()
+    
+    def jobs(self, sha256: str) -> List[str]:
+        with self.lock:
+            return [row[0] for row in self.conn.execute(
+                'SELECT job_id FROM upload_jobs WHERE sha256 = ? ORDER BY created_at', (sha256,)
+            )]
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ChunkedUploadManager:
+    """
+    Envoi reprenable par morceaux : chaque morceau est écrit directement sur
+    disque à la suite des précédents et l'empreinte SHA-256 est calculée au
+    fil de l'eau. L'en-tête PDF (et le nombre de pages des PDF linéarisés)
+    est contrôlé dès le premier morceau. Un fichier identique à un envoi
+    précédent est relié à celui-ci (lien physique) au lieu d'être recopié.
+    
+    Fichiers d'une session dans uploads/<upload_id>/ :
+    .<nom>.json (taille annoncée), .<nom>.part (en cours), puis <nom>.
+    """
+    def __init__(self, upload_folder: str, index: UploadIndex, max_bytes: int = None, max_pages: int = 0):
+        self.upload_folder = upload_folder
+        self.index = index
+        self.max_bytes = max_bytes or int(os.getenv('UPLOAD_MAX_BYTES', str(512 * 1024 * 1024)))
+        # Une session sans nouveau morceau pendant ce délai est supprimée
+        self.session_max_age = float(os.getenv('UPLOAD_SESSION_MAX_AGE_HOURS', '24')) * 3600
+        self.max_pages = max_pages
+        self.block_size = 1024 * 1024
+        # Empreintes partielles des sessions en cours : (upload_id, nom) -> (octets hachés, hash)
+        self.hashers: Dict[tuple, tuple] = {}
+        self.locks: Dict[tuple, threading.Lock] = {}
+        self.lock = threading.Lock()
+    
+    def _paths(self, upload_id: str, filename: str):
+        folder = os.path.join(self.upload_folder, upload_id)
+        return (
+            folder,
+            os.path.join(folder, f'.{filename}.json'),
+            os.path.join(folder, f'.{filename}.part'),
+            os.path.join(folder, filename)
+        )
+    
+    def _session_lock(self, key: tuple) -> threading.Lock:
+        with self.lock:
+            return self.locks.setdefault(key, threading.Lock())
+    
+    def create(self, upload_id: str, filename: str, size: int) -> Dict[str, Any]:
+        """
+        Ouvre une session d'envoi. Un doublon n'est reconnu qu'à la fin, sur
+        l'empreinte calculée : une empreinte annoncée par le client ne prouve
+        pas qu'il possède le fichier.
+        """
+        filename = secure_filename(filename or '')
+        if not filename:
+            raise UploadError('Nom de fichier manquant')
+        if not isinstance(size, int) or size <= 0:
+            raise UploadError('Taille du fichier invalide')
+        if size > self.max_bytes:
+            raise UploadError(f'Fichier trop volumineux: {size} octets (maximum {self.max_bytes})', 413)
+        
+        folder, meta_path, part_path, final_path = self._paths(upload_id, filename)
+        os.makedirs(folder, exist_ok=True)
+        
+        with open(meta_path, 'w', encoding='utf-8') as meta_file:
+            json.dump({'filename': filename, 'size': size, 'created_at': time.time()}, meta_file)
+        if not os.path.exists(part_path):
+            open(part_path, 'wb').close()
+        return self.status(upload_id, filename)
+    
+    def status(self, upload_id: str, filename: str, duplicate_of: str = None) -> Dict[str, Any]:
+        """
+        Avancement d'une session : octets reçus (offset à reprendre) et état
+        """
+        filename = secure_filename(filename or '')
+        _, meta_path, part_path, final_path = self._paths(upload_id, filename)
+        if os.path.exists(final_path):
+            size = os.path.getsize(final_path)
+            status = {'upload_id': upload_id, 'filename': filename, 'size': size, 'offset': size,
+                      'complete': True, 'path': final_path}
+            if duplicate_of:
+                status['duplicate_of'] = duplicate_of
+            return status
+        if not os.path.exists(meta_path):
+            raise UploadError('Envoi introuvable', 404)
+        with open(meta_path, encoding='utf-8') as meta_file:
+            meta = json.load(meta_file)
+        return {'upload_id': upload_id, 'filename': filename, 'size': meta['size'],
+                'offset': os.path.getsize(part_path) if os.path.exists(part_path) else 0, 'complete': False}
+    
+    def append(self, upload_id: str, filename: str, offset: int, stream: BinaryIO) -> Dict[str, Any]:
+        """
+        Écrit un morceau à la position offset (qui doit être la taille déjà
+        reçue) en lisant la requête par blocs, sans la garder en mémoire
+        """
+        filename = secure_filename(filename or '')
+        key = (upload_id, filename)
+        with self._session_lock(key):
+            status = self.status(upload_id, filename)
+            if status['complete']:
+                return status
+            if offset != status['offset']:
+                raise UploadError(f"Position attendue: {status['offset']}", 409)
+            _, meta_path, part_path, final_path = self._paths(upload_id, filename)
+            
+            received, digest = self._hasher(key, part_path)
+            with open(part_path, 'ab') as part_file:
+                while True:
+                    block = stream.read(self.block_size)
+                    if not block:
+                        break
+                    if received + len(block) > status['size']:
+                        raise UploadError('Données au-delà de la taille annoncée', 400)
+                    if received < 1024 and filename.lower().endswith('.pdf'):
+                        self._check_pdf_start(part_file, part_path, received, block)
+                    part_file.write(block)
+                    digest.update(block)
+                    received += len(block)
+            self.hashers[key] = (received, digest)
+            
+            if received < status['size']:
+                return self.status(upload_id, filename)
+            
+            # Fichier complet : empreinte finale et déduplication
+            del self.hashers[key]
+            sha256 = digest.hexdigest()
+            existing = self.index.find(sha256)
+            if existing is not None:
+                os.remove(part_path)
+                self._link(existing, final_path)
+            else:
+                os.replace(part_path, final_path)
+            os.remove(meta_path)
+            self.index.add(final_path, sha256, received)
+            result = self.status(upload_id, filename, duplicate_of=existing)
+            result['sha256'] = sha256
+            return result
+    
+    def abort(self, upload_id: str, filename: str):
+        """
+        Supprime une session refusée ou abandonnée
+        """
+        filename = secure_filename(filename or '')
+        _, meta_path, part_path, final_path = self._paths(upload_id, filename)
+        self.hashers.pop((upload_id, filename), None)
+        for path in (meta_path, part_path, final_path):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    def expire_sessions(self, max_age: float = None) -> int:
+        """
+        Supprime les sessions abandonnées (aucun morceau reçu depuis
+        max_age secondes) ; retourne le nombre de sessions supprimées
+        """
+        max_age = self.session_max_age if max_age is None else max_age
+        if not max_age or not os.path.isdir(self.upload_folder):
+            return 0
+        now = time.time()
+        expired = 0
+        for upload_id in os.listdir(self.upload_folder):
+            folder = os.path.join(self.upload_folder, upload_id)
+            if not os.path.isdir(folder):
+                continue
+            expired_here = 0
+            for name in os.listdir(folder):
+                if not (name.startswith('.') and name.endswith('.json')):
+                    continue
+                filename = name[1:-len('.json')]
+                _, meta_path, part_path, _ = self._paths(upload_id, filename)
+                try:
+                    last_activity = max(os.path.getmtime(path) for path in (meta_path, part_path) if os.path.exists(path))
+                except (OSError, ValueError):
+                    continue
+                if now - last_activity < max_age:
+                    continue
+                key = (upload_id, filename)
+                lock = self._session_lock(key)
+                if not lock.acquire(blocking=False):
+                    # Morceau en cours de réception
+                    continue
+                try:
+                    # Le fichier final éventuel (envoi terminé) est conservé
+                    self.hashers.pop(key, None)
+                    for path in (meta_path, part_path):
+                        if os.path.exists(path):
+                            os.remove(path)
+                    expired_here += 1
+                finally:
+                    lock.release()
+                with self.lock:
+                    self.locks.pop(key, None)
+            if expired_here:
+                expired += expired_here
+                try:
+                    # Dossier d'envoi devenu vide
+                    os.rmdir(folder)
+                except OSError:
+                    pass
+        return expired
+    
+    def _hasher(self, key: tuple, part_path: str):
+        """
+        Empreinte partielle de la session ; recalculée depuis le disque si
+        la session a commencé dans un autre processus ou avant un redémarrage
+        """
+        size = os.path.getsize(part_path)
+        state = self.hashers.get(key)
+        if state is not None and state[0] == size:
+            return state
+        digest = hashlib.sha256()
+        with open(part_path, 'rb') as part_file:
+            for block in iter(lambda: part_file.read(self.block_size), b''):
+                digest.update(block)
+        return size, digest
+    
+    def _check_pdf_start(self, part_file, part_path: str, received: int, block: bytes):
+        """
+        Refuse au plus tôt un fichier qui n'est pas un PDF ou un PDF
+        linéarisé qui dépasse le nombre de pages autorisé
+        """
+        part_file.flush()
+        with open(part_path, 'rb') as head_file:
+            head = head_file.read(received) + block
+        if len(head) >= 5 and not head.startswith(b'%PDF-'):
+            raise UploadError("Le fichier n'est pas un PDF", 415)
+        match = LINEARIZED_PAGES_PATTERN.search(head[:1024])
+        if match and self.max_pages and int(match.group(1)) > self.max_pages:
+            raise UploadError(f"PDF trop long: {int(match.group(1))} pages (maximum {self.max_pages})", 413)
+    
+    def _link(self, source: str, destination: str):
+        """
+        Lien physique vers un fichier identique (copie si le système de
+        fichiers ne le permet pas)
+        """
+        if os.path.exists(destination):
+            return
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copyfile(source, destination)
@@ -1,10 +1,12 @@
 import os
 import json
 from openpyxl import load_workbook, Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, NamedStyle
 from openpyxl.utils import get_column_letter
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Iterable, Iterator
+from metrics import span
 
 class ExcelProcessor:
     def __init__(self):
@@ -51,7 +53,8 @@ class ExcelProcessor:
         try:
             # Charger le workbook existant ou créer un nouveau
             if os.path.exists(excel_path):
-                wb = load_workbook(excel_path)
+                with span('excel_load'):
+                    wb = load_workbook(excel_path)
                 ws = wb.active
             else:
                 wb = Workbook()
@@ -70,33 +73,7 @@ class ExcelProcessor:
             
             # Ajouter les résultats
             for result in results:
-                page_num = result.get('page', 0)
-                ai_result = result.get('ai_result', {})
-                image_path = result.get('image_path', '')
-                
-                # Extraire les données de l'AI
-                content = ai_result.get('content', {})
-                if isinstance(content, str):
-                    # Si c'est une string, essayer de la parser
-                    try:
-                        content = json.loads(content)
-                    except:
-                        content = {'raw_text': content}
-                
-                # Préparer les données pour Excel
-                row_data = [
-                    page_num,
-                    content.get('type_document', ''),
-                    content.get('date', ''),
-                    content.get('montant', ''),
-                    content.get('devise', ''),
-                    content.get('emetteur', ''),
-                    content.get('destinataire', ''),
-                    content.get('numero_document', ''),
-                    json.dumps(content.get('autres_informations', {}), ensure_ascii=False),
-                    image_path,
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                ]
+                row_data = self._result_to_row(result)
                 
                 # Ajouter la ligne
                 for col, value in enumerate(row_data, 1):
@@ -109,36 +86,190 @@ class ExcelProcessor:
                 ws.column_dimensions[get_column_letter(col)].width = 15
             
             # Sauvegarder
-            wb.save(output_path)
+            with span('excel_save'):
+                wb.save(output_path)
             return output_path
             
         except Exception as e:
             raise Exception(f"Erreur lors de la mise à jour Excel: {str(e)}")
     
+    def _result_to_row(self, result: Dict[str, Any]) -> List[Any]:
+        """
+        Convertit le résultat d'analyse d'une page en ligne Excel
+        """
+        page_num = result.get('page', 0)
+        ai_result = result.get('ai_result', {})
+        image_path = result.get('image_path', '')
+        
+        # Extraire les données de l'AI
+        content = ai_result.get('content', {})
+        if isinstance(content, str):
+            # Si c'est une string, essayer de la parser
+            try:
+                content = json.loads(content)
+            except:
+                content = {'raw_text': content}
+        if not isinstance(content, dict):
+            content = {'raw_text': content}
+        
+        # Réponse non exploitable ou champs invalides : visibles dans la ligne
+        # plutôt que des colonnes vides sans explication
+        other = content.get('autres_informations', {})
+        if 'raw_text' in content or ai_result.get('validation_errors'):
+            other = dict(other) if isinstance(other, dict) else {'autres_informations': other}
+            if 'raw_text' in content:
+                other['reponse_brute'] = content['raw_text']
+            if ai_result.get('validation_errors'):
+                other['erreurs_validation'] = ai_result['validation_errors']
+        
+        # Préparer les données pour Excel
+        return [
+            page_num,
+            content.get('type_document', ''),
+            content.get('date', ''),
+            content.get('montant', ''),
+            content.get('devise', ''),
+            content.get('emetteur', ''),
+            content.get('destinataire', ''),
+            content.get('numero_document', ''),
+            json.dumps(other, ensure_ascii=False),
+            image_path,
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        ]
+    
+    def export_results_streaming(self, results: Iterable[Dict[str, Any]], output_path: str,
+                                 excel_path: str = None) -> str:
+        """
+        Écrit les résultats au fil de l'eau dans un classeur en mode write-only :
+        la mémoire reste constante quel que soit le nombre de lignes. Les styles
+        sont partagés via des styles nommés.
+        Un classeur existant (excel_path) ne peut pas être recopié sans perte en
+        write-only (formules, autres feuilles, mise en forme) : il est alors
+        complété par update_excel_with_results.
+        """
+        if excel_path and os.path.exists(excel_path):
+            return self.update_excel_with_results(excel_path, list(results), output_path)
+        try:
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet("Résultats Analyse")
+            header_style, zebra_style = self._register_named_styles(wb)
+            
+            # Les largeurs doivent être définies avant la première ligne
+            for col in range(1, len(self.default_headers) + 1):
+                ws.column_dimensions[get_column_letter(col)].width = 15
+            
+            def styled_row(values, style):
+                if not style:
+                    return list(values)
+                cells = []
+                for value in values:
+                    cell = WriteOnlyCell(ws, value=value)
+                    cell.style = style
+                    cells.append(cell)
+                return cells
+            
+            ws.append(styled_row(self.default_headers, header_style.name))
+            row_num = 1
+            for result in results:
+                row_num += 1
+                ws.append(styled_row(self._result_to_row(result), zebra_style.name if row_num % 2 == 0 else None))
+            
+            with span('excel_save'):
+                wb.save(output_path)
+            return output_path
+            
+        except Exception as e:
+            raise Exception(f"Erreur lors de l'export Excel: {str(e)}")
+    
+    def _register_named_styles(self, wb: Workbook):
+        """
+        Déclare les styles nommés d'en-tête et de ligne alternée du classeur
+        """
+        header_style = NamedStyle(name="resultats_entete")
+        header_style.font = Font(bold=True, color="FFFFFF")
+        header_style.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+        header_style.alignment = Alignment(horizontal="center", vertical="center")
+        
+        zebra_style = NamedStyle(name="resultats_zebra")
+        zebra_style.fill = PatternFill(start_color="F2F2F2", end_color="F2F2F2", fill_type="solid")
+        zebra_style.alignment = Alignment(horizontal="left", vertical="center")
+        
+        wb.add_named_style(header_style)
+        wb.add_named_style(zebra_style)
+        return header_style, zebra_style
+    
     def read_excel_data(self, excel_path: str) -> List[Dict[str, Any]]:
         """
         Lit les données d'un fichier Excel
         """
+        return list(self.iter_excel_rows(excel_path))
+    
+    def iter_excel_rows(self, excel_path: str, columns: List[str] = None,
+                        row_filter: Callable[[Dict[str, Any]], bool] = None,
+                        as_dict: bool = True) -> Iterator[Any]:
+        """
+        Lit un fichier Excel en lecture seule et produit les lignes une à une
+        (dictionnaires, ou tuples si as_dict=False). `columns` restreint les
+        colonnes retournées, `row_filter` reçoit la ligne complète en dictionnaire.
+        """
         try:
-            wb = load_workbook(excel_path, data_only=True)
-            ws = wb.active
-            
-            data = []
-            headers = []
+            wb = load_workbook(excel_path, read_only=True, data_only=True)
+            try:
+                rows = wb.active.iter_rows(values_only=True)
+                
+                # Lire les en-têtes
+                headers = list(next(rows, ()))
+                
+                if columns is None:
+                    indexes = list(range(len(headers)))
+                else:
+                    missing = [column for column in columns if column not in headers]
+                    if missing:
+                        raise KeyError(f"Colonnes introuvables: {', '.join(map(str, missing))}")
+                    indexes = [headers.index(column) for column in columns]
+                selected = [headers[index] for index in indexes]
+                
+                # Lire les données
+                for values in rows:
+                    if len(values) < len(headers):
+                        values = values + (None,) * (len(headers) - len(values))
+                    if row_filter is not None and not row_filter(dict(zip(headers, values))):
+                        continue
+                    projected = tuple(values[index] for index in indexes)
+                    yield dict(zip(selected, projected)) if as_dict else projected
+            finally:
+                wb.close()
             
-            # Lire les en-têtes
-            for col in range(1, ws.max_column + 1):
-                header = ws.cell(row=1, column=col).value
-                headers.append(header)
+        except Exception as e:
+            raise Exception(f"Erreur lors de la lecture Excel: {str(e)}")
+    
+    def read_excel_columns(self, excel_path: str, columns: List[str] = None,
+                           row_filter: Callable[[Dict[str, Any]], bool] = None,
+                           as_frame: bool = False):
+        """
+        Lit un fichier Excel en colonnes : un dictionnaire de listes par en-tête,
+        ou un DataFrame pandas si as_frame=True et pandas est installé
+        """
+        try:
+            wb = load_workbook(excel_path, read_only=True)
+            try:
+                headers = list(next(wb.active.iter_rows(max_row=1, values_only=True), ()))
+            finally:
+                wb.close()
             
-            # Lire les données
-            for row in range(2, ws.max_row + 1):
-                row_data = {}
-                for col in range(1, ws.max_column + 1):
-                    value = ws.cell(row=row, column=col).value
-                    row_data[headers[col-1]] = value
-                data.append(row_data)
+            names = columns if columns is not None else headers
+            data = {name: [] for name in names}
+            appends = [data[name].append for name in names]
+            for values in self.iter_excel_rows(excel_path, columns, row_filter, as_dict=False):
+                for append, value in zip(appends, values):
+                    append(value)
             
+            if as_frame:
+                try:
+                    import pandas as pd
+                except ImportError:
+                    return data
+                return pd.DataFrame(data, columns=names)
             return data
             
         except Exception as e:
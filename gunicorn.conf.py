@@ -0,0 +1,43 @@
+"""
+Configuration gunicorn pour la production :
+
+    gunicorn -c gunicorn.conf.py
+
+L'application est importée une seule fois dans le processus maître
+(preload_app) puis les workers sont créés par fork : le code et les
+bibliothèques (Flask, Pillow, openpyxl...) sont partagés en mémoire.
+Chaque worker construit ensuite ses propres processeurs et ouvre ses
+connexions vers Azure AI avant de recevoir des requêtes.
+
+L'état des jobs est enregistré dans une base partagée (JOB_STORE_PATH) :
+n'importe quel worker répond sur /jobs/<job_id>, son résultat et son flux
+d'événements, sans affinité de session sur le répartiteur.
+"""
+import os
+
+wsgi_app = 'app:app'
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_WORKERS', '1'))
+# Threads par worker : le travail lourd se fait dans les pools de jobs,
+# les threads servent surtout les requêtes courtes et les flux SSE
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', '8'))
+preload_app = True
+timeout = int(os.getenv('WEB_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+# Recycle les workers pour contenir la mémoire (0 = jamais)
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+accesslog = '-'
+
+def post_fork(server, worker):
+    """
+    Préchauffe le worker juste après le fork, avant ses premières requêtes
+    """
+    from app import warm_up, warm_state
+    warm_up()
+    if warm_state['error']:
+        server.log.warning(f"Worker {worker.pid} démarré sans Azure AI: {warm_state['error']}")
+    else:
+        server.log.info(f"Worker {worker.pid} prêt en {warm_state['seconds']} s")
@@ -0,0 +1,147 @@
+import io
+import os
+import math
+from PIL import Image, ImageChops
+from typing import Dict, Any, List, Tuple
+
+# Extension et type MIME de chaque format d'encodage supporté
+IMAGE_FORMATS = {
+    'PNG': ('.png', 'image/png'),
+    'JPEG': ('.jpg', 'image/jpeg'),
+    'WEBP': ('.webp', 'image/webp')
+}
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """
+    Estime les tokens facturés pour une image en détail "high" :
+    ramenée dans 2048x2048, puis petit côté à 768, 170 tokens par tuile
+    de 512 px plus 85 tokens fixes
+    """
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+def base64_size(size: int) -> int:
+    """
+    Taille en octets d'un contenu une fois encodé en base64
+    """
+    return 4 * math.ceil(size / 3)
+
+class ImagePreprocessor:
+    """
+    Réduit le poids des pages rendues avant l'envoi au modèle de vision :
+    redimensionnement, niveaux de gris, rognage des marges, encodage
+    JPEG/WebP et découpage en bandes quand le texte deviendrait illisible.
+    """
+    def __init__(self):
+        self.max_long_edge = int(os.getenv('IMAGE_MAX_LONG_EDGE', '2048'))
+        self.grayscale = os.getenv('IMAGE_GRAYSCALE', '0') == '1'
+        self.crop_margins = os.getenv('IMAGE_CROP_MARGINS', '0') == '1'
+        self.crop_threshold = int(os.getenv('IMAGE_CROP_THRESHOLD', '24'))
+        self.format = os.getenv('IMAGE_FORMAT', 'PNG').upper()
+        self.quality = int(os.getenv('IMAGE_QUALITY', '85'))
+        self.tiling = os.getenv('IMAGE_TILING', '0') == '1'
+        # Échelle minimale acceptée avant de découper la page en bandes
+        self.tile_min_scale = float(os.getenv('IMAGE_TILE_MIN_SCALE', '0.75'))
+        self.measure_baseline = os.getenv('IMAGE_MEASURE_BASELINE', '0') == '1'
+        
+        if self.format not in IMAGE_FORMATS:
+            raise ValueError(f"Format d'image non supporté: {self.format}")
+    
+    @property
+    def extension(self) -> str:
+        return IMAGE_FORMATS[self.format][0]
+    
+    @property
+    def mime_type(self) -> str:
+        return IMAGE_FORMATS[self.format][1]
+    
+    def process(self, image: Image.Image, crop: bool = False) -> Tuple[List[bytes], Dict[str, Any]]:
+        """
+        Prépare une page rendue et retourne les images encodées
+        (une par bande) ainsi que les statistiques avant / après.
+        crop force le rognage des marges pour cette page.
+        """
+        original_size = image.size
+        stats = {
+            'original_dimensions': original_size,
+            'original_tokens': estimate_image_tokens(*original_size)
+        }
+        if self.measure_baseline:
+            # Coûteux : réencode la page en PNG sans traitement pour comparaison
+            baseline = self._encode(image, 'PNG')
+            stats['original_bytes'] = len(baseline)
+            stats['original_base64_bytes'] = base64_size(len(baseline))
+        
+        if self.grayscale:
+            image = image.convert('L')
+        if self.crop_margins or crop:
+            image = self._crop_margins(image)
+        
+        tiles = [self._resize(tile) for tile in self._split(image)]
+        encoded = [self._encode(tile, self.format) for tile in tiles]
+        
+        stats.update({
+            'format': self.format,
+            'dimensions': [tile.size for tile in tiles],
+            'tiles': len(tiles),
+            'bytes': sum(len(data) for data in encoded),
+            'base64_bytes': sum(base64_size(len(data)) for data in encoded),
+            'tokens': sum(estimate_image_tokens(*tile.size) for tile in tiles)
+        })
+        return encoded, stats
+    
+    def _crop_margins(self, image: Image.Image, padding: int = 20) -> Image.Image:
+        """
+        Rogne les marges blanches autour du contenu
+        """
+        gray = image.convert('L')
+        diff = ImageChops.difference(gray, Image.new('L', gray.size, 255))
+        bbox = diff.point(lambda p: 255 if p > self.crop_threshold else 0).getbbox()
+        if not bbox:
+            return image
+        left, top, right, bottom = bbox
+        return image.crop((
+            max(0, left - padding),
+            max(0, top - padding),
+            min(image.width, right + padding),
+            min(image.height, bottom + padding)
+        ))
+    
+    def _split(self, image: Image.Image) -> List[Image.Image]:
+        """
+        Découpe la page en bandes horizontales si la réduction nécessaire
+        ferait passer l'échelle sous tile_min_scale (petit texte)
+        """
+        scale = self.max_long_edge / max(image.size)
+        if not self.tiling or scale >= self.tile_min_scale:
+            return [image]
+        
+        count = math.ceil(image.height * self.tile_min_scale / self.max_long_edge)
+        if count <= 1:
+            return [image]
+        band = math.ceil(image.height / count)
+        return [
+            image.crop((0, top, image.width, min(image.height, top + band)))
+            for top in range(0, image.height, band)
+        ]
+    
+    def _resize(self, image: Image.Image) -> Image.Image:
+        scale = self.max_long_edge / max(image.size)
+        if scale >= 1:
+            return image
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        return image.resize(size, Image.LANCZOS)
+    
+    def _encode(self, image: Image.Image, image_format: str) -> bytes:
+        buffer = io.BytesIO()
+        if image_format == 'PNG':
+            image.save(buffer, 'PNG')
+        else:
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            image.save(buffer, image_format, quality=self.quality)
+        return buffer.getvalue()
@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, Iterator, Optional
+
+class Job:
+    """
+    Traitement exécuté en arrière-plan, avec sa progression et son résultat
+    """
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.finished_at = None
+        self.progress = {'stage': 'En attente', 'pages_done': 0, 'pages_total': None}
+        self.result = None
+        self.error = None
+        self.version = 0
+        self.changed = threading.Condition()
+        # Base partagée où l'état est recopié à chaque changement (voir JobStore)
+        self.store = None
+        # Job relu dans la base : exécuté par un autre worker
+        self.remote = False
+        self.worker = f'{socket.gethostname()}:{os.getpid()}'
+    
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> 'Job':
+        """
+        Copie en lecture seule d'un job enregistré par JobStore
+        """
+        job = cls()
+        for name in ('status', 'progress', 'result', 'error', 'created_at', 'finished_at', 'version', 'worker'):
+            setattr(job, name, state[name])
+        job.id = state['job_id']
+        job.remote = True
+        return job
+    
+    @property
+    def finished(self) -> bool:
+        return self.status in ('done', 'error')
+    
+    def update(self, **progress):
+        """
+        Met à jour la progression et réveille les clients en attente
+        """
+        with self.changed:
+            self.progress.update(progress)
+            self.version += 1
+            self.changed.notify_all()
+        self._persist()
+    
+    def _set_status(self, status: str, result: Dict[str, Any] = None, error: str = None):
+        with self.changed:
+            self.status = status
+            self.result = result
+            self.error = error
+            if self.finished:
+                self.finished_at = time.time()
+            self.version += 1
+            self.changed.notify_all()
+        self._persist()
+    
+    def _persist(self):
+        if self.store is None:
+            return
+        with self.changed:
+            state = self.to_dict()
+            state.update(result=self.result, version=self.version, worker=self.worker)
+        try:
+            self.store.save(state)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print(f"⚠️ État du job {self.id} non enregistré: {e}")
+    
+    def wait_for_change(self, version: int, timeout: float = None) -> int:
+        """
+        Attend une version plus récente que `version` et la retourne
+        """
+        with self.changed:
+            self.changed.wait_for(lambda: self.version > version, timeout=timeout)
+            return self.version
+    
+    def to_dict(self) -> Dict[str, Any]:
+        with self.changed:
+            return {
+                'job_id': self.id,
+                'status': self.status,
+                'progress': dict(self.progress),
+                'error': self.error,
+                'created_at': self.created_at,
+                'finished_at': self.finished_at
+            }
+
+class JobStore:
+    """
+    État des jobs (progression, résultat, erreur) dans une base SQLite
+    partagée par les workers : n'importe quel worker répond sur un job,
+    quel que soit celui qui l'exécute. Les jobs terminés sont supprimés
+    après `retention` secondes.
+    """
+    def __init__(self, path: str = None, retention: float = None):
+        self.path = path or os.getenv('JOB_STORE_PATH', os.path.join('cache', 'jobs.sqlite'))
+        if retention is None:
+            retention = float(os.getenv('JOB_RETENTION_HOURS', '168')) * 3600
+        self.retention = retention
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, status TEXT NOT NULL, progress TEXT NOT NULL, result TEXT, error TEXT, '
+            'created_at REAL NOT NULL, finished_at REAL, version INTEGER NOT NULL, worker TEXT)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at)')
+        self.conn.commit()
+    
+    def save(self, state: Dict[str, Any]):
+        """
+        Enregistre l'état d'un job (ignoré s'il est plus ancien que celui en base)
+        """
+        result = state.get('result')
+        row = (
+            state['job_id'], state['status'], json.dumps(state['progress'], ensure_ascii=False),
+            json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+            state.get('error'), state['created_at'], state.get('finished_at'), state['version'], state.get('worker')
+        )
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO jobs (id, status, progress, result, error, created_at, finished_at, version, worker) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (id) DO UPDATE SET status = excluded.status, progress = excluded.progress, '
+                'result = excluded.result, error = excluded.error, finished_at = excluded.finished_at, '
+                'version = excluded.version, worker = excluded.worker '
+                'WHERE excluded.version > jobs.version',
+                row
+            )
+            self.conn.commit()
+    
+    def load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT id, status, progress, result, error, created_at, finished_at, version, worker '
+                'FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'job_id': row[0],
+            'status': row[1],
+            'progress': json.loads(row[2]),
+            'result': json.loads(row[3]) if row[3] is not None else None,
+            'error': row[4],
+            'created_at': row[5],
+            'finished_at': row[6],
+            'version': row[7],
+            'worker': row[8]
+        }
+    
+    def prune(self):
+        """
+        Supprime les jobs terminés depuis plus longtemps que la rétention
+        """
+        if not self.retention:
+            return
+        with self.lock:
+            self.conn.execute('DELETE FROM jobs WHERE finished_at < ?', (time.time() - self.retention,))
+            self.conn.commit()
+
+class JobManager:
+    """
+    File de traitements exécutés par un pool de threads à concurrence bornée.
+    Seuls les `history` derniers traitements terminés sont conservés en
+    mémoire ; avec un `store`, les autres (et ceux des autres workers) sont
+    relus dans la base.
+    """
+    def __init__(self, max_workers: int = 2, history: int = 100, store: Optional[JobStore] = None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.history = history
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.store = store
+        # Intervalle de relecture de la base pour suivre un job d'un autre worker
+        self.poll_interval = float(os.getenv('JOB_POLL_SECONDS', '1'))
+    
+    def submit(self, func: Callable[..., Dict[str, Any]], *args, **kwargs) -> Job:
+        """
+        Met en file `func(job, *args, **kwargs)` et retourne le job immédiatement
+        """
+        job = Job()
+        job.store = self.store
+        job._persist()
+        with self.lock:
+            self.jobs[job.id] = job
+            self._prune()
+        if self.store is not None:
+            self.store.prune()
+        self.executor.submit(self._run, job, func, args, kwargs)
+        return job
+    
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None and self.store is not None:
+            job = self._load(job_id)
+        return job
+    
+    def _load(self, job_id: str) -> Optional[Job]:
+        state = self.store.load(job_id)
+        if state is None:
+            return None
+        job = Job.from_state(state)
+        if not job.finished and not self._worker_alive(job.worker):
+            job.status = 'error'
+            job.error = "Traitement interrompu : le worker qui l'exécutait s'est arrêté"
+            job.version += 1
+        return job
+    
+    @staticmethod
+    def _worker_alive(worker: Optional[str]) -> bool:
+        """
+        Faux seulement quand on sait le processus arrêté (même machine)
+        """
+        host, _, pid = (worker or '').rpartition(':')
+        if host != socket.gethostname() or not pid.isdigit():
+            return True
+        if int(pid) == os.getpid():
+            # Job de ce processus absent de la mémoire : exécution précédente
+            return False
+        if os.name != 'posix':
+            return True
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            pass
+        return True
+    
+    def _wait_remote(self, job: Job, version: int, timeout: float) -> Job:
+        """
+        Relit la base jusqu'à une version plus récente que `version`
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self._load(job.id) or job
+            remaining = deadline - time.monotonic()
+            if job.version > version or remaining <= 0:
+                return job
+            time.sleep(min(self.poll_interval, remaining))
+    
+    def stream(self, job: Job, keepalive: float = 15.0) -> Iterator[Dict[str, Any]]:
+        """
+        Produit l'état du job à chaque changement jusqu'à la fin du traitement
+        (None quand rien n'a changé pendant `keepalive` secondes)
+        """
+        version = -1
+        while True:
+            if job.remote:
+                job = self._wait_remote(job, version, keepalive)
+                new_version = job.version
+            else:
+                new_version = job.wait_for_change(version, timeout=keepalive)
+            if new_version == version:
+                yield None
+                continue
+            version = new_version
+            state = job.to_dict()
+            yield state
+            if state['status'] in ('done', 'error'):
+                return
+    
+    def _run(self, job: Job, func, args, kwargs):
+        job._set_status('running')
+        try:
+            result = func(job, *args, **kwargs)
+            job._set_status('done', result=result)
+        except Exception as e:
+            job._set_status('error', error=str(e))
+    
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[job_id]
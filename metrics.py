@@ -0,0 +1,138 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List, Tuple
+
+# Bornes des histogrammes de durée, en secondes
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: Dict[str, str] = None) -> str:
+    pairs = list(zip(labelnames, values)) + list((extra or {}).items())
+    if not pairs:
+        return ''
+    escaped = [
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    ]
+    return '{' + ','.join(escaped) + '}'
+
+class Counter:
+    """
+    Compteur monotone, éventuellement découpé par étiquettes
+    """
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+    
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+    
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+class Histogram:
+    """
+    Histogramme cumulatif au format Prometheus
+    """
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.series: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+    
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self.lock:
+            series = self.series.setdefault(key, {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+    
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                for bound, count in zip(self.buckets, series['counts']):
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, {"le": bound})} {count}')
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, {"le": "+Inf"})} {series["count"]}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {series["sum"]}')
+                lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {series["count"]}')
+        return lines
+
+class MetricsRegistry:
+    """
+    Ensemble des métriques exposées sur /metrics (propres au processus)
+    """
+    def __init__(self):
+        self.metrics = []
+    
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+    
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+    
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'factures_stage_duration_seconds', 'Durée de chaque étape du pipeline', ('stage',))
+PAGES_PROCESSED = REGISTRY.counter(
+    'factures_pages_processed_total', 'Pages traitées par source (image, text)', ('source',))
+AZURE_REQUESTS = REGISTRY.counter(
+    'factures_azure_requests_total', 'Requêtes HTTP envoyées à Azure AI par code de statut', ('status',))
+AZURE_RETRIES = REGISTRY.counter(
+    'factures_azure_retries_total', 'Nouvelles tentatives après une erreur réseau, un 5xx ou un 429')
+AZURE_BYTES_UPLOADED = REGISTRY.counter(
+    'factures_azure_bytes_uploaded_total', 'Octets de corps de requête envoyés à Azure AI')
+AZURE_TOKENS = REGISTRY.counter(
+    'factures_azure_tokens_total', 'Tokens facturés par type (prompt, completion)', ('type',))
+AZURE_REASKS = REGISTRY.counter(
+    'factures_azure_reasks_total', 'Nouvelles demandes pour des champs manquants ou invalides')
+AZURE_BATCH_FALLBACKS = REGISTRY.counter(
+    'factures_azure_batch_fallbacks_total', 'Requêtes groupées dont la réponse n\'a pas pu être répartie par page')
+AZURE_DEPLOYMENT_REQUESTS = REGISTRY.counter(
+    'factures_azure_deployment_requests_total', 'Requêtes Azure AI par déploiement et code de statut',
+    ('deployment', 'status'))
+CACHE_REQUESTS = REGISTRY.counter(
+    'factures_cache_requests_total', 'Consultations du cache de résultats (hit, miss)', ('result',))
+
+@contextmanager
+def span(stage: str, timings: Dict[str, float] = None):
+    """
+    Mesure la durée d'une étape : alimente l'histogramme et, si fourni,
+    cumule la durée en millisecondes dans timings['<stage>_ms']
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        if timings is not None:
+            key = f'{stage}_ms'
+            timings[key] = round(timings.get(key, 0) + elapsed * 1000, 1)
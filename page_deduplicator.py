@@ -0,0 +1,178 @@
+import os
+import json
+import sqlite3
+import threading
+from PIL import Image
+from typing import Dict, Any, Optional, List, Tuple
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """
+    Empreinte perceptuelle par différence (dHash) sur hash_size² bits
+    """
+    gray = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(gray.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+def hamming_distance(first: int, second: int) -> int:
+    return bin(first ^ second).count('1')
+
+class PageDeduplicator:
+    """
+    Repère les pages blanches et les pages quasi identiques (conditions
+    générales, pages de garde...) pour réutiliser un résultat déjà obtenu
+    au lieu d'appeler Azure. Les empreintes sont conservées en mémoire pour
+    le job courant et dans une base SQLite pour les jobs suivants.
+    
+    La réutilisation des pages quasi identiques est désactivée par défaut :
+    deux factures d'un même modèle ne diffèrent parfois que par quelques
+    chiffres, invisibles pour une empreinte perceptuelle. Le seuil doit
+    donc être réglé sur des documents réels avant de l'activer.
+    """
+    def __init__(self, path: str = None):
+        self.enabled = os.getenv('DEDUP_ENABLED', '0') == '1'
+        self.skip_blank = os.getenv('DEDUP_SKIP_BLANK', '1') == '1'
+        self.across_jobs = os.getenv('DEDUP_ACROSS_JOBS', '1') == '1'
+        self.max_distance = int(os.getenv('DEDUP_MAX_DISTANCE', '2'))
+        self.hash_size = int(os.getenv('DEDUP_HASH_SIZE', '16'))
+        # Part maximale de pixels sombres (< 160) d'une page considérée blanche
+        self.blank_ink_ratio = float(os.getenv('DEDUP_BLANK_INK_RATIO', '0.00002'))
+        self.path = path or os.getenv('DEDUP_PATH', os.path.join('cache', 'pages.sqlite'))
+        self.lock = threading.Lock()
+        self.conn = None
+        self.known: List[Tuple[int, str, Dict[str, Any]]] = []
+        self.blank_pages = 0
+        self.duplicate_pages = 0
+        self.tokens_saved = 0
+        self.loaded = False
+    
+    def _load(self):
+        """
+        Ouvre la base des empreintes au premier usage (appelé sous verrou)
+        """
+        if self.loaded:
+            return
+        self.loaded = True
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS page_hashes ('
+            'hash TEXT NOT NULL, prompt TEXT NOT NULL, result TEXT NOT NULL, '
+            'PRIMARY KEY (hash, prompt))'
+        )
+        self.conn.commit()
+        for hash_hex, prompt, result in self.conn.execute('SELECT hash, prompt, result FROM page_hashes'):
+            self.known.append((int(hash_hex, 16), prompt, json.loads(result)))
+    
+    def fingerprint(self, image: Image.Image) -> Dict[str, Any]:
+        """
+        Empreinte d'une page rendue et indicateur de page blanche
+        """
+        # Réduction par blocs (rapide) à environ 1000 px avant la conversion en
+        # niveaux de gris : assez pour voir l'encre, et le dHash n'utilise que
+        # quelques pixels
+        factor = max(image.size) // 1000
+        if factor > 1 and image.mode in ('L', 'RGB', 'RGBA'):
+            image = image.reduce(factor)
+        gray = image.convert('L')
+        # Une page blanche n'a presque aucun pixel d'encre (quelques poussières au plus)
+        histogram = gray.histogram()
+        blank = sum(histogram[:160]) / max(1, sum(histogram)) <= self.blank_ink_ratio
+        return {
+            'hash': f'{dhash(gray, self.hash_size):0{self.hash_size * self.hash_size // 4}x}',
+            'blank': blank
+        }
+    
+    @property
+    def active(self) -> bool:
+        return self.enabled or self.skip_blank
+    
+    def find(self, page_hash: str, prompt: str) -> Optional[Dict[str, Any]]:
+        """
+        Résultat d'une page déjà analysée à moins de max_distance bits
+        """
+        if not self.enabled or not self.across_jobs:
+            return None
+        value = int(page_hash, 16)
+        with self.lock:
+            self._load()
+            best = None
+            for known_value, known_prompt, result in self.known:
+                if known_prompt != prompt:
+                    continue
+                distance = hamming_distance(value, known_value)
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, result)
+        if best is None:
+            return None
+        return self.reuse(best[1], best[0])
+    
+    def reuse(self, result: Dict[str, Any], distance: int) -> Dict[str, Any]:
+        """
+        Copie d'un résultat pour une page en double ; l'usage de la requête
+        d'origine est reporté dans usage_saved
+        """
+        usage = result.get('usage') or {}
+        with self.lock:
+            self.duplicate_pages += 1
+            self.tokens_saved += usage.get('total_tokens', 0)
+        return dict(result, usage={}, usage_saved=usage, deduplicated=True, dedup_distance=distance)
+    
+    def is_near(self, first_hash: str, second_hash: str) -> Tuple[bool, int]:
+        """
+        Indique si deux empreintes sont à moins de max_distance bits
+        """
+        distance = hamming_distance(int(first_hash, 16), int(second_hash, 16))
+        return distance <= self.max_distance, distance
+    
+    def remember(self, page_hash: str, prompt: str, result: Dict[str, Any]):
+        """
+        Enregistre le résultat réussi d'une page pour les jobs suivants
+        """
+        if not self.enabled or not self.across_jobs or not result.get('success') or result.get('deduplicated'):
+            return
+        stored = dict(result)
+        with self.lock:
+            self._load()
+            self.known.append((int(page_hash, 16), prompt, stored))
+            if self.conn is not None:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO page_hashes (hash, prompt, result) VALUES (?, ?, ?)',
+                    (page_hash, prompt, json.dumps(stored, ensure_ascii=False))
+                )
+                self.conn.commit()
+    
+    def blank_result(self) -> Dict[str, Any]:
+        """
+        Résultat attribué à une page blanche sans appel au modèle
+        """
+        with self.lock:
+            self.blank_pages += 1
+        return {
+            'success': True,
+            'content': {'type_document': 'page_blanche'},
+            'raw_content': '',
+            'usage': {},
+            'deduplicated': True,
+            'blank': True
+        }
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Pages et tokens économisés depuis le démarrage
+        """
+        with self.lock:
+            return {
+                'blank_pages': self.blank_pages,
+                'duplicate_pages': self.duplicate_pages,
+                'tokens_saved': self.tokens_saved
+            }
\ No newline at end of file
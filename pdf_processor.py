@@ -1,17 +1,100 @@
 import os
-from pdf2image import convert_from_path
+import re
+import queue
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pdf2image import convert_from_path, pdfinfo_from_path
 from PIL import Image
 import tempfile
+from image_preprocessor import ImagePreprocessor
+from page_deduplicator import PageDeduplicator
+from metrics import span
+
+PAGE_SIZE_PATTERN = re.compile(r'^Page\s+(\d+)\s+size:\s+([\d.]+)\s+x\s+([\d.]+)', re.MULTILINE)
+
+class PageWriter:
+    """
+    Écrit les images d'aperçu en arrière-plan. Le pipeline n'attend pas
+    l'écriture ; seule la route d'aperçu attend le fichier demandé (flush).
+    """
+    def __init__(self, max_workers=1):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='page-writer')
+        self.pending = {}
+        self.lock = threading.Lock()
+    
+    def write(self, path, data):
+        with self.lock:
+            future = self.executor.submit(self._write, path, data)
+            self.pending[os.path.abspath(path)] = future
+        future.add_done_callback(lambda _, key=os.path.abspath(path): self._forget(key, future))
+    
+    def _write(self, path, data):
+        with span('image_write'):
+            # Fichier temporaire puis renommage : l'aperçu ne lit jamais une image partielle
+            temp_path = f"{path}.part"
+            with open(temp_path, 'wb') as image_file:
+                image_file.write(data)
+            os.replace(temp_path, path)
+    
+    def _forget(self, key, future):
+        with self.lock:
+            if self.pending.get(key) is future:
+                del self.pending[key]
+    
+    def flush(self, path=None):
+        """
+        Attend l'écriture d'un fichier donné, ou de toutes les écritures en cours
+        """
+        with self.lock:
+            if path is None:
+                futures = list(self.pending.values())
+            else:
+                futures = [self.pending[key] for key in [os.path.abspath(path)] if key in self.pending]
+        for future in futures:
+            future.result()
 
 class PDFProcessor:
-    def __init__(self):
+    def __init__(self, page_window=None, preprocessor=None, deduplicator=None, render_workers=None):
         self.supported_formats = ['.pdf']
+        # Résolution de rendu des pages
+        self.dpi = int(os.getenv('PDF_RENDER_DPI', '300'))
+        # Mode adaptatif : premier rendu à basse résolution (0 = désactivé),
+        # seules les pages mal extraites sont rendues à nouveau à self.dpi
+        self.adaptive_dpi = int(os.getenv('PDF_ADAPTIVE_DPI', '0'))
+        # Rognage des marges blanches lors du second rendu
+        self.adaptive_crop = os.getenv('PDF_ADAPTIVE_CROP', '1') == '1'
+        # Processus pdftoppm lancés en parallèle pour rendre une suite de pages
+        self.render_workers = max(1, render_workers or int(os.getenv('PDF_RENDER_WORKERS', str(os.cpu_count() or 1))))
+        # Préparation des images avant l'envoi au modèle (taille, format...)
+        self.preprocessor = preprocessor or ImagePreprocessor()
+        # Empreintes des pages pour repérer les pages blanches et les doublons
+        self.deduplicator = deduplicator or PageDeduplicator()
+        # Nombre maximal de pages rendues gardées en mémoire à la fois
+        self.page_window = page_window or int(os.getenv('PDF_PAGE_WINDOW', '4'))
+        # Nombre minimal de caractères pour considérer qu'une page a une couche texte
+        self.min_text_chars = int(os.getenv('PDF_TEXT_MIN_CHARS', '50'))
+        # Pages gardées en mémoire (octets encodés) au lieu d'être relues sur disque
+        self.in_memory = os.getenv('PDF_IN_MEMORY', '0') == '1'
+        # En mémoire, écriture différée des images pour l'aperçu (/images/<filename>)
+        self.preview_images = os.getenv('PDF_PREVIEW_IMAGES', '1') == '1'
+        self.page_writer = PageWriter() if self.in_memory and self.preview_images else None
     
     def convert_pdf_to_images(self, pdf_path, output_folder):
         """
         Convertit un fichier PDF en images PNG
         Retourne une liste d'informations sur les images créées
         """
+        return list(self.iter_pdf_pages(pdf_path, output_folder))
+    
+    def iter_pdf_pages(self, pdf_path, output_folder, window=None, text_first=False):
+        """
+        Convertit un PDF en images PNG par blocs de pages (first_page/last_page)
+        et produit les informations de chaque image dès qu'elle est écrite.
+        La mémoire est bornée par la taille de la fenêtre, pas par le document.
+        En mode text_first, les pages ayant une couche texte exploitable ne sont
+        pas rendues : leur texte est produit à la place (source 'text').
+        """
         try:
             # Vérifier que le fichier existe
             if not os.path.exists(pdf_path):
@@ -20,71 +103,336 @@ class PDFProcessor:
             # Créer le dossier de sortie s'il n'existe pas
             os.makedirs(output_folder, exist_ok=True)
             
-            # Convertir le PDF en images
-            images = convert_from_path(pdf_path, dpi=300)
-            
-            images_info = []
+            window = max(1, window or self.page_window)
+            page_count = self.get_page_count(pdf_path)
             base_filename = os.path.splitext(os.path.basename(pdf_path))[0]
             
-            for i, image in enumerate(images):
-                # Nom du fichier image
-                image_filename = f"{base_filename}_page_{i+1:03d}.png"
-                image_path = os.path.join(output_folder, image_filename)
+            text_pages = {}
+            if text_first:
+                with span('pdf_text'):
+                    text_layers = self.extract_text_pages(pdf_path)
+                for page_num, text in enumerate(text_layers, 1):
+                    if self.has_text_layer(text):
+                        text_pages[page_num] = text
+            
+            # Un document plus long que la fenêtre est rendu par blocs d'au moins
+            # render_workers pages dans des fichiers temporaires, relus un par un :
+            # tous les cœurs travaillent sans garder le bloc entier en mémoire
+            to_files = page_count > window and self.render_workers > 1
+            chunk = max(window, self.render_workers) if to_files else window
+            
+            for first_page in range(1, page_count + 1, chunk):
+                last_page = min(first_page + chunk - 1, page_count)
                 
-                # Sauvegarder l'image
-                image.save(image_path, 'PNG', quality=95)
+                # Rendre uniquement les suites de pages sans couche texte
+                runs = self._scanned_runs(first_page, last_page, text_pages)
+                rendered = (
+                    item
+                    for run_first, run_last in runs
+                    for item in self._render_run(pdf_path, run_first, run_last, base_filename, output_folder, to_files)
+                )
                 
-                # Ajouter les informations de l'image
-                images_info.append({
-                    'page': i + 1,
-                    'path': image_path,
-                    'filename': image_filename,
-                    'size': os.path.getsize(image_path),
-                    'dimensions': image.size
-                })
-            
-            return images_info
+                image_info = None
+                for page_num in range(first_page, last_page + 1):
+                    if page_num in text_pages:
+                        yield self._text_page_info(page_num, text_pages[page_num])
+                        continue
+                    if image_info is None:
+                        image_info = next(rendered, None)
+                    # Une page que poppler n'a pas produite est ignorée sans décaler les suivantes
+                    if image_info is not None and image_info['page'] == page_num:
+                        yield image_info
+                        image_info = None
+                rendered.close()
             
         except Exception as e:
             raise Exception(f"Erreur lors de la conversion PDF: {str(e)}")
     
-    def get_pdf_info(self, pdf_path):
+    @property
+    def first_pass_dpi(self):
+        return self.adaptive_dpi or self.dpi
+    
+    def _render_run(self, pdf_path, first_page, last_page, base_filename, output_folder, to_files):
+        """
+        Rend une suite de pages avec render_workers processus pdftoppm et
+        produit les informations de chaque page dans l'ordre. Avec to_files,
+        les pages sont écrites en PPM (non compressé) dans un dossier
+        temporaire local et chargées une par une.
+        """
+        thread_count = min(self.render_workers, last_page - first_page + 1)
+        dpi = self.first_pass_dpi
+        timings = {}
+        if not to_files:
+            with span('pdf_render', timings):
+                images = convert_from_path(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page,
+                                           thread_count=thread_count)
+            # Le temps de rendu d'une suite est réparti entre ses pages
+            render_ms = round(timings['pdf_render_ms'] / max(1, len(images)), 1)
+            for page_num in range(first_page, first_page + len(images)):
+                # Libérer chaque image dès qu'elle est préparée
+                image, images[page_num - first_page] = images[page_num - first_page], None
+                image_info = self._save_page_image(image, page_num, base_filename, output_folder)
+                image_info['timing']['pdf_render_ms'] = render_ms
+                image_info['dpi'] = dpi
+                yield image_info
+            return
+        
+        with tempfile.TemporaryDirectory(prefix='pdf_render_') as render_folder:
+            with span('pdf_render', timings):
+                paths = convert_from_path(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page,
+                                          thread_count=thread_count, output_folder=render_folder,
+                                          fmt='ppm', paths_only=True)
+            render_ms = round(timings['pdf_render_ms'] / max(1, len(paths)), 1)
+            for page_num, path in enumerate(paths, first_page):
+                with Image.open(path) as image:
+                    image.load()
+                    image_info = self._save_page_image(image, page_num, base_filename, output_folder)
+                os.remove(path)
+                image_info['timing']['pdf_render_ms'] = render_ms
+                image_info['dpi'] = dpi
+                yield image_info
+    
+    def extract_text_pages(self, pdf_path):
+        """
+        Extrait la couche texte de chaque page avec pdftotext (poppler).
+        Retourne une liste vide si pdftotext n'est pas disponible.
+        """
+        try:
+            completed = subprocess.run(
+                ['pdftotext', '-layout', '-enc', 'UTF-8', pdf_path, '-'],
+                capture_output=True, check=True
+            )
+        except (OSError, subprocess.CalledProcessError):
+            return []
+        
+        # pdftotext sépare les pages par un saut de page
+        pages = completed.stdout.decode('utf-8', errors='replace').split('\f')
+        if pages and not pages[-1].strip():
+            pages.pop()
+        return pages
+    
+    def has_text_layer(self, text):
+        """
+        Indique si le texte extrait d'une page est suffisant pour l'analyse
+        """
+        return len(''.join(text.split())) >= self.min_text_chars
+    
+    def _scanned_runs(self, first_page, last_page, text_pages):
         """
-        Récupère les informations de base du PDF
+        Découpe [first_page, last_page] en suites contiguës de pages à rendre
+        """
+        runs = []
+        for page_num in range(first_page, last_page + 1):
+            if page_num in text_pages:
+                continue
+            if runs and runs[-1][1] == page_num - 1:
+                runs[-1][1] = page_num
+            else:
+                runs.append([page_num, page_num])
+        return runs
+    
+    def _text_page_info(self, page_num, text):
+        """
+        Informations d'une page analysée à partir de sa couche texte
+        """
+        return {
+            'page': page_num,
+            'path': None,
+            'filename': None,
+            'size': len(text.encode('utf-8')),
+            'dimensions': None,
+            'text': text,
+            'source': 'text'
+        }
+    
+    def prefetch_pages(self, pdf_path, output_folder, window=None, text_first=False):
+        """
+        Rend les pages dans un thread en arrière-plan pendant que l'appelant
+        consomme les précédentes. Au plus `window` pages attendent dans la file.
+        """
+        window = max(1, window or self.page_window)
+        pages = queue.Queue(maxsize=window)
+        done = object()
+        stop = threading.Event()
+        
+        def put(item) -> bool:
+            # Jamais bloquant indéfiniment : le consommateur peut abandonner
+            # (job en échec, client parti) alors que la file est pleine
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        def producer():
+            try:
+                for image_info in self.iter_pdf_pages(pdf_path, output_folder, window, text_first):
+                    if not put(image_info):
+                        return
+                put(done)
+            except Exception as e:
+                put(e)
+        
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = pages.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+    
+    def _save_page_image(self, image, page_num, base_filename, output_folder, crop=False):
+        """
+        Prépare une page rendue, la sauvegarde et retourne ses informations.
+        En mode in_memory, les octets encodés sont joints aux informations
+        ('data') et l'écriture sur disque, si elle est demandée, est différée.
+        """
+        timings = {}
+        with span('image_preprocess', timings):
+            encoded, stats = self.preprocessor.process(image, crop=crop)
+        extension = self.preprocessor.extension
+        
+        # Une page découpée en bandes donne un fichier par bande
+        paths = []
+        for tile_num, data in enumerate(encoded, 1):
+            suffix = f"_tile_{tile_num}" if len(encoded) > 1 else ""
+            image_filename = f"{base_filename}_page_{page_num:03d}{suffix}{extension}"
+            paths.append(os.path.join(output_folder, image_filename))
+        
+        if not self.in_memory:
+            with span('image_write', timings):
+                for image_path, data in zip(paths, encoded):
+                    # Sauvegarder l'image
+                    with open(image_path, 'wb') as image_file:
+                        image_file.write(data)
+        elif self.page_writer is not None:
+            for image_path, data in zip(paths, encoded):
+                self.page_writer.write(image_path, data)
+        else:
+            # Aucun fichier : la page n'existe qu'en mémoire
+            paths = [None] * len(encoded)
+        
+        # Ajouter les informations de l'image
+        image_info = {
+            'page': page_num,
+            'path': paths[0],
+            'filename': os.path.basename(paths[0]) if paths[0] else None,
+            'size': stats['bytes'],
+            'dimensions': stats['dimensions'][0],
+            'mime_type': self.preprocessor.mime_type,
+            'preprocessing': stats,
+            'timing': timings,
+            'source': 'image'
+        }
+        if len(paths) > 1 and paths[0]:
+            image_info['tiles'] = paths
+        if self.in_memory:
+            # Octets encodés transmis directement au client Azure AI
+            image_info['data'] = encoded
+        if self.deduplicator.active:
+            with span('fingerprint', timings):
+                image_info['fingerprint'] = self.deduplicator.fingerprint(image)
+        return image_info
+    
+    def get_page_count(self, pdf_path):
+        """
+        Retourne le nombre de pages du PDF sans le rendre
+        """
+        return pdfinfo_from_path(pdf_path)['Pages']
+    
+    def get_pdf_info(self, pdf_path, details=False):
+        """
+        Récupère les informations de base du PDF sans rendre les pages (pdfinfo).
+        Avec details=True, ajoute pour chaque page sa taille, la présence d'une
+        couche texte et d'images intégrées.
         """
         try:
-            images = convert_from_path(pdf_path, dpi=300)
-            return {
-                'page_count': len(images),
-                'file_size': os.path.getsize(pdf_path)
+            info = pdfinfo_from_path(pdf_path)
+            pdf_info = {
+                'page_count': info['Pages'],
+                'file_size': os.path.getsize(pdf_path),
+                'page_size': info.get('Page size'),
+                'encrypted': info.get('Encrypted', 'no').startswith('yes'),
+                'pdf_version': info.get('PDF version')
             }
+            if details:
+                pdf_info['pages'] = self._page_details(pdf_path, info['Pages'])
+            return pdf_info
         except Exception as e:
             raise Exception(f"Erreur lors de la lecture du PDF: {str(e)}")
     
-    def extract_specific_page(self, pdf_path, page_number, output_folder):
+    def _page_details(self, pdf_path, page_count):
+        """
+        Propriétés de chaque page via pdfinfo, pdftotext et pdfimages
+        """
+        pages = [
+            {'page': page_num, 'width_pts': None, 'height_pts': None, 'has_text': False, 'has_images': False}
+            for page_num in range(1, page_count + 1)
+        ]
+        
+        output = subprocess.run(
+            ['pdfinfo', '-f', '1', '-l', str(page_count), pdf_path],
+            capture_output=True, check=True
+        ).stdout.decode('utf-8', errors='replace')
+        for match in PAGE_SIZE_PATTERN.finditer(output):
+            page = pages[int(match.group(1)) - 1]
+            page['width_pts'] = float(match.group(2))
+            page['height_pts'] = float(match.group(3))
+        
+        for page_num, text in enumerate(self.extract_text_pages(pdf_path)[:page_count], 1):
+            pages[page_num - 1]['has_text'] = self.has_text_layer(text)
+        
+        try:
+            output = subprocess.run(
+                ['pdfimages', '-list', pdf_path], capture_output=True, check=True
+            ).stdout.decode('utf-8', errors='replace')
+            # Deux lignes d'en-tête, puis une ligne par image avec le numéro de page en tête
+            for line in output.splitlines()[2:]:
+                fields = line.split()
+                if fields and fields[0].isdigit() and 0 < int(fields[0]) <= page_count:
+                    pages[int(fields[0]) - 1]['has_images'] = True
+        except (OSError, subprocess.CalledProcessError):
+            pass
+        
+        return pages
+    
+    def extract_specific_page(self, pdf_path, page_number, output_folder, dpi=None, crop=False):
         """
         Extrait une page spécifique du PDF
         """
         try:
-            images = convert_from_path(pdf_path, dpi=300, first_page=page_number, last_page=page_number)
+            dpi = dpi or self.dpi
+            images = convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number)
             
             if not images:
                 raise Exception(f"Page {page_number} non trouvée")
             
-            image = images[0]
             base_filename = os.path.splitext(os.path.basename(pdf_path))[0]
-            image_filename = f"{base_filename}_page_{page_number:03d}.png"
-            image_path = os.path.join(output_folder, image_filename)
-            
-            image.save(image_path, 'PNG', quality=95)
+            os.makedirs(output_folder, exist_ok=True)
             
-            return {
-                'page': page_number,
-                'path': image_path,
-                'filename': image_filename,
-                'size': os.path.getsize(image_path),
-                'dimensions': image.size
-            }
+            image_info = self._save_page_image(images[0], page_number, base_filename, output_folder, crop=crop)
+            image_info['dpi'] = dpi
+            return image_info
             
         except Exception as e:
-            raise Exception(f"Erreur lors de l'extraction de la page {page_number}: {str(e)}") 
\ No newline at end of file
+            raise Exception(f"Erreur lors de l'extraction de la page {page_number}: {str(e)}")
+    
+    def refine_page(self, pdf_path, image_info, output_folder):
+        """
+        Second rendu d'une page du mode adaptatif, à pleine résolution et
+        rogné sur le contenu si adaptive_crop ; remplace l'aperçu basse résolution
+        """
+        timings = {}
+        with span('pdf_refine', timings):
+            refined = self.extract_specific_page(pdf_path, image_info['page'], output_folder,
+                                                 dpi=self.dpi, crop=self.adaptive_crop)
+        refined['timing'].update(timings)
+        refined['first_pass_dpi'] = image_info.get('dpi')
+        return refined
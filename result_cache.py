@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+class ResultCache(ABC):
+    """
+    Cache des résultats d'extraction, adressé par le contenu de la requête.
+    Les sous-classes implémentent _get / _set / _clear.
+    """
+    def __init__(self, ttl: float = 0, max_entries: int = 0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """
+        Construit une clé SHA-256 à partir d'éléments sérialisables en JSON
+        """
+        digest = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, bytes):
+                digest.update(part)
+            else:
+                digest.update(json.dumps(part, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+            digest.update(b'\x00')
+        return digest.hexdigest()
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            value = self._get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+    
+    def set(self, key: str, value: Dict[str, Any]):
+        with self.lock:
+            self._set(key, value)
+    
+    def clear(self):
+        with self.lock:
+            self._clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Compteurs de succès / échecs du cache
+        """
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0
+        }
+    
+    def _expired(self, created_at: float) -> bool:
+        return bool(self.ttl) and time.time() - created_at > self.ttl
+    
+    @abstractmethod
+    def _get(self, key):
+        pass
+    
+    @abstractmethod
+    def _set(self, key, value):
+        pass
+    
+    @abstractmethod
+    def _clear(self):
+        pass
+
+class MemoryResultCache(ResultCache):
+    """
+    Cache LRU en mémoire (limité au processus courant)
+    """
+    def __init__(self, ttl: float = 0, max_entries: int = 0):
+        super().__init__(ttl, max_entries)
+        self.entries = OrderedDict()
+    
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        created_at, value = entry
+        if self._expired(created_at):
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return dict(value)
+    
+    def _set(self, key, value):
+        self.entries[key] = (time.time(), dict(value))
+        self.entries.move_to_end(key)
+        while self.max_entries and len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    
+    def _clear(self):
+        self.entries.clear()
+
+class SQLiteResultCache(ResultCache):
+    """
+    Cache persistant sur disque (SQLite), partagé entre les redémarrages.
+    Éviction par TTL puis LRU au-delà de max_entries.
+    """
+    def __init__(self, path: str, ttl: float = 0, max_entries: int = 0):
+        super().__init__(ttl, max_entries)
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+            'created_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_results_accessed ON results (accessed_at)')
+        self.conn.commit()
+    
+    def _get(self, key):
+        row = self.conn.execute('SELECT value, created_at FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        value, created_at = row
+        if self._expired(created_at):
+            self.conn.execute('DELETE FROM results WHERE key = ?', (key,))
+            self.conn.commit()
+            return None
+        self.conn.execute('UPDATE results SET accessed_at = ? WHERE key = ?', (time.time(), key))
+        self.conn.commit()
+        return json.loads(value)
+    
+    def _set(self, key, value):
+        now = time.time()
+        self.conn.execute(
+            'INSERT OR REPLACE INTO results (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+            (key, json.dumps(value, ensure_ascii=False), now, now)
+        )
+        self._evict(now)
+        self.conn.commit()
+    
+    def _evict(self, now: float):
+        if self.ttl:
+            self.conn.execute('DELETE FROM results WHERE created_at < ?', (now - self.ttl,))
+        if self.max_entries:
+            self.conn.execute(
+                'DELETE FROM results WHERE key IN ('
+                'SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+    
+    def _clear(self):
+        self.conn.execute('DELETE FROM results')
+        self.conn.commit()
+
+def create_result_cache() -> Optional[ResultCache]:
+    """
+    Construit le cache configuré par les variables d'environnement
+    (AZURE_AI_CACHE = sqlite | memory | none)
+    """
+    backend = os.getenv('AZURE_AI_CACHE', 'sqlite').lower()
+    ttl = float(os.getenv('AZURE_AI_CACHE_TTL', str(30 * 24 * 3600)))
+    max_entries = int(os.getenv('AZURE_AI_CACHE_MAX_ENTRIES', '10000'))
+    
+    if backend == 'sqlite':
+        path = os.getenv('AZURE_AI_CACHE_PATH', os.path.join('cache', 'results.sqlite'))
+        return SQLiteResultCache(path, ttl=ttl, max_entries=max_entries)
+    if backend == 'memory':
+        return MemoryResultCache(ttl=ttl, max_entries=max_entries)
+    return None
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+# Champs extraits recopiés dans des colonnes (indexées pour les recherches)
+FIELDS = ('type_document', 'date', 'montant', 'devise', 'emetteur', 'destinataire', 'numero_document')
+
+# Filtres acceptés par query : nom -> (condition SQL, conversion de la valeur)
+FILTERS = {
+    'job_id': ('job_id = ?', str),
+    'document': ('document = ?', str),
+    'type_document': ('type_document = ?', str),
+    'devise': ('devise = ?', str),
+    'emetteur': ('emetteur = ?', str),
+    'destinataire': ('destinataire = ?', str),
+    'numero_document': ('numero_document = ?', str),
+    'content_hash': ('content_hash = ?', str),
+    'date_from': ('date >= ?', str),
+    'date_to': ('date <= ?', str),
+    'montant_min': ('montant >= ?', float),
+    'montant_max': ('montant <= ?', float),
+    'valid': ('valid = ?', lambda value: int(str(value).lower() in ('1', 'true', 'oui')))
+}
+
+class ResultStore:
+    """
+    Historique des résultats d'extraction par page dans une base SQLite,
+    indexé sur les champs servant aux recherches (numéro de document,
+    émetteur, date, montant, empreinte du contenu). Les exports Excel sont
+    produits à partir de cette base plutôt qu'en relisant des classeurs.
+    """
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv('RESULT_STORE_PATH', os.path.join('cache', 'extractions.sqlite'))
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS extractions ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL, document TEXT, '
+            'page INTEGER NOT NULL, source TEXT, image_path TEXT, success INTEGER NOT NULL, valid INTEGER, '
+            'type_document TEXT, date TEXT, montant REAL, devise TEXT, emetteur TEXT, '
+            'destinataire TEXT, numero_document TEXT, content TEXT, content_hash TEXT, '
+            'ai_result TEXT NOT NULL, created_at REAL NOT NULL)'
+        )
+        for column in ('numero_document', 'emetteur', 'date', 'montant', 'content_hash'):
+            self.conn.execute(f'CREATE INDEX IF NOT EXISTS idx_extractions_{column} ON extractions ({column})')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_extractions_job ON extractions (job_id, page)')
+        self.conn.commit()
+    
+    @staticmethod
+    def content_hash(content: Any) -> Optional[str]:
+        """
+        Empreinte SHA-256 du contenu extrait (JSON canonique)
+        """
+        if content in (None, '', {}):
+            return None
+        return hashlib.sha256(
+            json.dumps(content, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        ).hexdigest()
+    
+    def _row(self, job_id: str, document: str, result: Dict[str, Any], now: float) -> Tuple:
+        ai_result = result.get('ai_result') or {}
+        content = ai_result.get('content')
+        fields = content if isinstance(content, dict) else {}
+        values = []
+        for field in FIELDS:
+            value = fields.get(field)
+            if field == 'montant':
+                try:
+                    value = float(value) if value not in (None, '') and not isinstance(value, bool) else None
+                except (TypeError, ValueError):
+                    value = None
+            elif value is not None and not isinstance(value, str):
+                value = json.dumps(value, ensure_ascii=False)
+            values.append(value)
+        valid = ai_result.get('valid')
+        return (
+            job_id, document, result.get('page', 0), result.get('source'), result.get('image_path'),
+            int(bool(ai_result.get('success'))), None if valid is None else int(valid),
+            *values,
+            json.dumps(content, ensure_ascii=False) if content is not None else None,
+            self.content_hash(content),
+            json.dumps(ai_result, ensure_ascii=False), now
+        )
+    
+    def add(self, job_id: str, document: str, results: Iterable[Dict[str, Any]]):
+        """
+        Enregistre les résultats de pages d'un job (une transaction)
+        """
+        now = time.time()
+        rows = [self._row(job_id, document, result, now) for result in results]
+        if not rows:
+            return
+        with self.lock:
+            self.conn.executemany(
+                'INSERT INTO extractions (job_id, document, page, source, image_path, success, valid, '
+                f'{", ".join(FIELDS)}, content, content_hash, ai_result, created_at) '
+                f'VALUES ({", ".join("?" * (11 + len(FIELDS)))})',
+                rows
+            )
+            self.conn.commit()
+    
+    def _where(self, filters: Dict[str, Any]) -> Tuple[str, List[Any]]:
+        conditions, params = [], []
+        for name, value in filters.items():
+            if value in (None, ''):
+                continue
+            if name not in FILTERS:
+                raise ValueError(f"Filtre inconnu: {name}")
+            condition, convert = FILTERS[name]
+            try:
+                params.append(convert(value))
+            except (TypeError, ValueError):
+                raise ValueError(f"Valeur invalide pour {name}: {value}")
+            conditions.append(condition)
+        return (' WHERE ' + ' AND '.join(conditions)) if conditions else '', params
+    
+    def query(self, filters: Dict[str, Any] = None, limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+        """
+        Recherche paginée (du plus récent au plus ancien)
+        """
+        where, params = self._where(filters or {})
+        with self.lock:
+            total = self.conn.execute(f'SELECT COUNT(*) FROM extractions{where}', params).fetchone()[0]
+            cursor = self.conn.execute(
+                f'SELECT id, job_id, document, page, source, success, valid, {", ".join(FIELDS)}, '
+                f'content, content_hash, created_at FROM extractions{where} '
+                'ORDER BY id DESC LIMIT ? OFFSET ?',
+                params + [limit, offset]
+            )
+            columns = [description[0] for description in cursor.description]
+            rows = cursor.fetchall()
+        items = []
+        for row in rows:
+            item = dict(zip(columns, row))
+            item['success'] = bool(item['success'])
+            item['valid'] = None if item['valid'] is None else bool(item['valid'])
+            item['content'] = json.loads(item['content']) if item['content'] else None
+            items.append(item)
+        return {'total': total, 'limit': limit, 'offset': offset, 'items': items}
+    
+    def iter_results(self, filters: Dict[str, Any] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Résultats au format du pipeline ({'page', 'image_path', 'source',
+        'ai_result'}), dans l'ordre des jobs puis des pages : c'est l'entrée
+        attendue par les exports Excel
+        """
+        # Filtres vérifiés dès l'appel, avant le début de la lecture
+        where, params = self._where(filters or {})
+        return self._iter_rows(f"{where} AND id > ?" if where else ' WHERE id > ?', params)
+    
+    def _iter_rows(self, where: str, params: List[Any]) -> Iterator[Dict[str, Any]]:
+        last_id = 0
+        while True:
+            # Lecture par blocs : la base n'est pas verrouillée pendant l'export
+            with self.lock:
+                rows = self.conn.execute(
+                    f'SELECT id, page, image_path, source, ai_result FROM extractions{where} ORDER BY id LIMIT 1000',
+                    params + [last_id]
+                ).fetchall()
+            if not rows:
+                return
+            for last_id, page, image_path, source, ai_result in rows:
+                yield {'page': page, 'image_path': image_path, 'source': source, 'ai_result': json.loads(ai_result)}
+    
+    def seen_before(self, job_id: str, numero_document: str, emetteur: str = None) -> List[Dict[str, Any]]:
+        """
+        Pages d'autres jobs portant le même numéro de document (et le même émetteur)
+        """
+        if not numero_document:
+            return []
+        sql = 'SELECT job_id, document, page, date, montant FROM extractions WHERE numero_document = ? AND job_id != ?'
+        params = [numero_document, job_id]
+        if emetteur:
+            sql += ' AND emetteur = ?'
+            params.append(emetteur)
+        with self.lock:
+            rows = self.conn.execute(sql + ' ORDER BY id LIMIT 10', params).fetchall()
+        return [dict(zip(('job_id', 'document', 'page', 'date', 'montant'), row)) for row in rows]
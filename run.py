@@ -5,27 +5,25 @@ Script de démarrage pour l'application d'analyse PDF avec Azure AI
 
 import os
 import sys
+import shutil
+import importlib.util
 from pathlib import Path
 
 def check_dependencies():
     """Vérifie que toutes les dépendances sont installées"""
-    try:
-        import flask
-        import pdf2image
-        import openpyxl
-        import requests
-        print("✅ Toutes les dépendances Python sont installées")
-    except ImportError as e:
-        print(f"❌ Dépendance manquante: {e}")
+    # Recherche des modules sans les importer : le démarrage reste rapide
+    missing = [name for name in ('flask', 'pdf2image', 'PIL', 'openpyxl', 'requests', 'dotenv')
+               if importlib.util.find_spec(name) is None]
+    if missing:
+        print(f"❌ Dépendance manquante: {', '.join(missing)}")
         print("Installez les dépendances avec: pip install -r requirements.txt")
         return False
+    print("✅ Toutes les dépendances Python sont installées")
     
-    # Vérifier Poppler
-    try:
-        from pdf2image import convert_from_path
-        # Test simple pour vérifier que poppler est disponible
+    # Vérifier Poppler (outils pdftoppm et pdfinfo dans le PATH)
+    if shutil.which('pdftoppm') and shutil.which('pdfinfo'):
         print("✅ Poppler est configuré")
-    except Exception as e:
+    else:
         print("❌ Poppler n'est pas configuré correctement")
         print("Installez Poppler:")
         print("  macOS: brew install poppler")
@@ -94,7 +92,8 @@ def main():
     # Importer et démarrer l'application
     try:
         from app import app
-        app.run(debug=True, host='0.0.0.0', port=5000)
+        # Sans FLASK_DEBUG, pas de rechargeur : un seul processus démarre
+        app.run(debug=os.getenv('FLASK_DEBUG', '0').lower() in ('1', 'true'), host='0.0.0.0', port=5000)
     except KeyboardInterrupt:
         print("\n👋 Arrêt du serveur")
     except Exception as e:
@@ -1,5 +1,6 @@
 // Variables globales
 let uploadedFiles = {
+    upload_id: null,
     pdf_path: null,
     excel_path: null
 };
@@ -108,13 +109,14 @@ async function uploadFiles() {
         }
         
         uploadedFiles = {
+            upload_id: uploadResult.upload_id,
             pdf_path: uploadResult.pdf_path,
             excel_path: uploadResult.excel_path
         };
         
         // Étape 2: Traitement avec Azure AI
         updateProgress(30, 'Conversion PDF en images...');
-        const processResult = await processFilesWithAI(uploadedFiles.pdf_path, uploadedFiles.excel_path, prompt);
+        const processResult = await processFilesWithAI(uploadedFiles.upload_id, prompt);
         
         if (!processResult.success) {
             throw new Error(processResult.error);
@@ -159,28 +161,101 @@ async function uploadFilesToServer(pdfFile, excelFile) {
 }
 
 // Traitement avec Azure AI
-async function processFilesWithAI(pdfPath, excelPath, prompt) {
+async function processFilesWithAI(uploadId, prompt) {
     const response = await fetch('/process', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json'
         },
         body: JSON.stringify({
-            pdf_path: pdfPath,
-            excel_path: excelPath,
+            upload_id: uploadId,
             prompt: prompt
         })
     });
     
-    const result = await response.json();
+    const job = await response.json();
     
     if (!response.ok) {
+        throw new Error(job.error || 'Erreur lors du traitement');
+    }
+    
+    // Le traitement tourne en arrière-plan : suivre sa progression
+    await waitForJob(job);
+    
+    const resultResponse = await fetch(job.result_url);
+    const result = await resultResponse.json();
+    
+    if (!resultResponse.ok) {
         throw new Error(result.error || 'Erreur lors du traitement');
     }
     
+    result.success = true;
     return result;
 }
 
+// Suivi de la progression d'un job (Server-Sent Events, sinon polling)
+function waitForJob(job) {
+    return new Promise((resolve, reject) => {
+        const onState = (state) => {
+            updateJobProgress(state);
+            if (state.status === 'done') {
+                resolve(state);
+                return true;
+            }
+            if (state.status === 'error') {
+                reject(new Error(state.error || 'Erreur lors du traitement'));
+                return true;
+            }
+            return false;
+        };
+        
+        const poll = async () => {
+            try {
+                const response = await fetch(job.status_url);
+                const state = await response.json();
+                if (!response.ok) {
+                    throw new Error(state.error || 'Erreur lors du suivi du traitement');
+                }
+                if (!onState(state)) {
+                    setTimeout(poll, 1000);
+                }
+            } catch (error) {
+                reject(error);
+            }
+        };
+        
+        if (!window.EventSource) {
+            poll();
+            return;
+        }
+        
+        const source = new EventSource(job.events_url);
+        source.onmessage = (event) => {
+            if (onState(JSON.parse(event.data))) {
+                source.close();
+            }
+        };
+        source.onerror = () => {
+            source.close();
+            poll();
+        };
+    });
+}
+
+// Progression par page entre 30% et 95%
+function updateJobProgress(state) {
+    const progress = state.progress || {};
+    let percentage = 30;
+    if (progress.pages_total) {
+        percentage += Math.round(65 * progress.pages_done / progress.pages_total);
+    }
+    let text = progress.stage || 'Traitement en cours...';
+    if (progress.pages_total) {
+        text += ` (${progress.pages_done}/${progress.pages_total} pages)`;
+    }
+    updateProgress(percentage, text);
+}
+
 // Affichage des résultats
 function showResults(results) {
     const container = document.getElementById('resultsContainer');
@@ -222,8 +297,13 @@ function createResultCard(result, index) {
                 <h5 class="fw-bold">
                     <i class="fas fa-file-image me-2"></i>Page ${result.page}
                 </h5>
-                <img src="/images/${result.image_path.split('/').pop()}" 
-                     class="image-preview" alt="Page ${result.page}">
+                ${result.image_url ?
+                    `<img src="${result.image_url}" 
+                         class="image-preview" alt="Page ${result.page}">` :
+                    result.source === 'text' ?
+                    `<p class="text-muted"><i class="fas fa-font me-2"></i>Analysée par la couche texte</p>` :
+                    `<p class="text-muted"><i class="fas fa-image me-2"></i>Aperçu non conservé</p>`
+                }
             </div>
             <div class="col-md-9">
                 <div class="d-flex justify-content-between align-items-start mb-3">
@@ -259,9 +339,8 @@ function createResultCard(result, index) {
 
 // Téléchargement des résultats
 function downloadResults() {
-    if (currentResults && currentResults.output_excel) {
-        const filename = currentResults.output_excel.split('/').pop();
-        window.open(`/download/${filename}`, '_blank');
+    if (currentResults && currentResults.download_url) {
+        window.open(currentResults.download_url, '_blank');
     } else {
         showAlert('Aucun fichier à télécharger.', 'error');
     }
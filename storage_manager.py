@@ -0,0 +1,347 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List
+
+# Budgets par défaut : (taille maximale en Mo, âge maximal en heures, 0 = illimité)
+DEFAULT_BUDGETS = {
+    'uploads': (1024, 24),
+    'images': (2048, 24),
+    'output': (1024, 168)
+}
+
+class StorageManager:
+    """
+    Rétention des dossiers uploads/, images/ et output/. Un manifeste SQLite
+    recense chaque fichier (taille, dernier accès, origine) ; un thread en
+    arrière-plan supprime les fichiers trop anciens puis les moins récemment
+    utilisés tant qu'un dossier dépasse son budget. Les fichiers évincés
+    restent dans le manifeste pour répondre vite (404 ou régénération).
+    """
+    def __init__(self, folders: Dict[str, str], path: str = None):
+        self.folders = {name: os.path.abspath(folder) for name, folder in folders.items()}
+        self.budgets = {}
+        for name in folders:
+            max_mb, max_hours = DEFAULT_BUDGETS.get(name, (0, 0))
+            self.budgets[name] = (
+                float(os.getenv(f'STORAGE_{name.upper()}_MAX_MB', str(max_mb))) * 1024 * 1024,
+                float(os.getenv(f'STORAGE_{name.upper()}_MAX_AGE_HOURS', str(max_hours))) * 3600
+            )
+        # Délai pendant lequel un fichier récent n'est jamais évincé
+        self.grace_period = float(os.getenv('STORAGE_GRACE_SECONDS', '600'))
+        self.interval = float(os.getenv('STORAGE_SWEEP_SECONDS', '300'))
+        self.path = path or os.getenv('STORAGE_MANIFEST_PATH', os.path.join('cache', 'storage.sqlite'))
+        
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # Un commit par image enregistrée : en WAL, pas de fsync à chaque fois
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'folder TEXT NOT NULL, name TEXT NOT NULL, size INTEGER NOT NULL, '
+            'created_at REAL NOT NULL, accessed_at REAL NOT NULL, '
+            'evicted INTEGER NOT NULL DEFAULT 0, source TEXT, '
+            'PRIMARY KEY (folder, name))'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_files_accessed ON files (folder, evicted, accessed_at)')
+        self._create_totals()
+        # Fichiers utilisés par un job en cours, tous workers confondus
+        # (compteur par chemin absolu ; un pin plus vieux que pin_max_age est
+        # celui d'un processus arrêté brutalement)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS pins ('
+            'path TEXT PRIMARY KEY, count INTEGER NOT NULL, updated_at REAL NOT NULL)'
+        )
+        self.conn.commit()
+        self.pin_max_age = float(os.getenv('STORAGE_PIN_MAX_HOURS', '24')) * 3600
+        
+        # Nettoyages complémentaires appelés à chaque passage (ex: envois abandonnés)
+        self.sweep_hooks = []
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+    
+    def _create_totals(self):
+        """
+        Taille et nombre de fichiers présents par dossier, tenus à jour par
+        des triggers : le contrôle du budget à chaque enregistrement ne
+        parcourt pas le manifeste, et reste juste entre plusieurs workers
+        """
+        # INSERT OR REPLACE supprime l'ancienne ligne : son trigger doit s'exécuter
+        # (et impose REPLACE aux INSERT des triggers, d'où les NOT EXISTS)
+        self.conn.execute('PRAGMA recursive_triggers=ON')
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'folder_totals'"
+        ).fetchone()
+        if exists:
+            return
+        self.conn.executescript('''
+            CREATE TABLE folder_totals (folder TEXT PRIMARY KEY, files INTEGER NOT NULL, bytes INTEGER NOT NULL);
+            INSERT INTO folder_totals (folder, files, bytes)
+                SELECT folder, COUNT(*), SUM(size) FROM files WHERE evicted = 0 GROUP BY folder;
+            CREATE TRIGGER IF NOT EXISTS files_totals_insert AFTER INSERT ON files WHEN new.evicted = 0 BEGIN
+                INSERT INTO folder_totals (folder, files, bytes) SELECT new.folder, 0, 0
+                    WHERE NOT EXISTS (SELECT 1 FROM folder_totals WHERE folder = new.folder);
+                UPDATE folder_totals SET files = files + 1, bytes = bytes + new.size WHERE folder = new.folder;
+            END;
+            CREATE TRIGGER IF NOT EXISTS files_totals_delete AFTER DELETE ON files WHEN old.evicted = 0 BEGIN
+                UPDATE folder_totals SET files = files - 1, bytes = bytes - old.size WHERE folder = old.folder;
+            END;
+            CREATE TRIGGER IF NOT EXISTS files_totals_update AFTER UPDATE OF size, evicted ON files BEGIN
+                UPDATE folder_totals SET files = files - 1, bytes = bytes - old.size
+                    WHERE folder = old.folder AND old.evicted = 0;
+                INSERT INTO folder_totals (folder, files, bytes) SELECT new.folder, 0, 0
+                    WHERE NOT EXISTS (SELECT 1 FROM folder_totals WHERE folder = new.folder);
+                UPDATE folder_totals SET files = files + 1, bytes = bytes + new.size
+                    WHERE folder = new.folder AND new.evicted = 0;
+            END;
+        ''')
+    
+    def start(self):
+        """
+        Lance le nettoyage périodique en arrière-plan (inventaire au démarrage)
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='storage-sweeper', daemon=True)
+            self.thread.start()
+    
+    def _run(self):
+        self.scan()
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"⚠️ Nettoyage du stockage impossible: {e}")
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+    
+    def _split(self, path: str):
+        """
+        (dossier géré, nom relatif) d'un chemin, ou None s'il n'est pas géré
+        """
+        path = os.path.abspath(path)
+        for name, folder in self.folders.items():
+            if path.startswith(folder + os.sep):
+                return name, os.path.relpath(path, folder)
+        return None
+    
+    def register(self, path: str, size: int = None, source: Dict[str, Any] = None):
+        """
+        Ajoute (ou rafraîchit) un fichier au manifeste. La taille peut être
+        fournie quand le fichier est encore en cours d'écriture.
+        """
+        location = self._split(path)
+        if location is None:
+            return
+        if size is None:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                return
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO files (folder, name, size, created_at, accessed_at, evicted, source) '
+                'VALUES (?, ?, ?, ?, ?, 0, ?)',
+                (*location, size, now, now, json.dumps(source) if source else None)
+            )
+            self.conn.commit()
+            over_budget = self._over_budget(location[0])
+        if over_budget:
+            self.wakeup.set()
+    
+    def locate(self, folder: str, name: str) -> Optional[str]:
+        """
+        Chemin d'un fichier présent (dernier accès mis à jour), ou None.
+        Un fichier évincé est signalé sans toucher au disque.
+        """
+        path = os.path.join(self.folders[folder], name)
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT evicted FROM files WHERE folder = ? AND name = ?', (folder, name)
+            ).fetchone()
+            if row is not None and row[0]:
+                return None
+            if row is not None:
+                self.conn.execute(
+                    'UPDATE files SET accessed_at = ? WHERE folder = ? AND name = ?', (time.time(), folder, name)
+                )
+                self.conn.commit()
+        if os.path.exists(path):
+            if row is None:
+                # Fichier produit hors de l'application (ex: batch.py)
+                self.register(path)
+            return path
+        return None
+    
+    def source(self, folder: str, name: str) -> Optional[Dict[str, Any]]:
+        """
+        Origine enregistrée d'un fichier (ex: PDF et page d'une image)
+        """
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT source FROM files WHERE folder = ? AND name = ?', (folder, name)
+            ).fetchone()
+        if row is None or not row[0]:
+            return None
+        return json.loads(row[0])
+    
+    @contextmanager
+    def in_use(self, *paths: str):
+        """
+        Protège des fichiers de l'éviction le temps d'un traitement
+        """
+        keys = [os.path.abspath(path) for path in paths if path]
+        with self.lock:
+            for key in keys:
+                self.conn.execute(
+                    'INSERT INTO pins (path, count, updated_at) VALUES (?, 1, ?) '
+                    'ON CONFLICT (path) DO UPDATE SET count = count + 1, updated_at = excluded.updated_at',
+                    (key, time.time())
+                )
+            self.conn.commit()
+        try:
+            yield
+        finally:
+            with self.lock:
+                for key in keys:
+                    self.conn.execute('UPDATE pins SET count = count - 1 WHERE path = ?', (key,))
+                self.conn.execute('DELETE FROM pins WHERE count <= 0')
+                self.conn.commit()
+    
+    def scan(self):
+        """
+        Inventorie les fichiers présents sur disque mais absents du manifeste
+        et marque comme évincés ceux qui ont disparu
+        """
+        for folder, root in self.folders.items():
+            found = {}
+            for directory, _, filenames in os.walk(root):
+                for filename in filenames:
+                    if filename.endswith('.part') or filename.startswith('.'):
+                        # Écriture ou envoi en cours (voir PageWriter, ChunkedUploadManager)
+                        continue
+                    path = os.path.join(directory, filename)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    found[os.path.relpath(path, root)] = stat
+            with self.lock:
+                known = {
+                    name: evicted for name, evicted in
+                    self.conn.execute('SELECT name, evicted FROM files WHERE folder = ?', (folder,))
+                }
+                for name, stat in found.items():
+                    if name not in known or known[name]:
+                        self.conn.execute(
+                            'INSERT OR REPLACE INTO files (folder, name, size, created_at, accessed_at, evicted, source) '
+                            'VALUES (?, ?, ?, ?, ?, 0, (SELECT source FROM files WHERE folder = ? AND name = ?))',
+                            (folder, name, stat.st_size, stat.st_mtime, stat.st_atime, folder, name)
+                        )
+                for name, evicted in known.items():
+                    if not evicted and name not in found:
+                        self.conn.execute(
+                            'UPDATE files SET evicted = 1 WHERE folder = ? AND name = ?', (folder, name)
+                        )
+                self.conn.commit()
+    
+    def _over_budget(self, folder: str) -> bool:
+        max_bytes, _ = self.budgets[folder]
+        if not max_bytes:
+            return False
+        row = self.conn.execute('SELECT bytes FROM folder_totals WHERE folder = ?', (folder,)).fetchone()
+        return row is not None and row[0] > max_bytes
+    
+    def sweep(self):
+        """
+        Évince les fichiers trop anciens puis les moins récemment utilisés
+        jusqu'à revenir sous le budget de taille de chaque dossier
+        """
+        for hook in self.sweep_hooks:
+            try:
+                hook()
+            except Exception as e:
+                print(f"⚠️ Nettoyage complémentaire impossible: {e}")
+        now = time.time()
+        with self.lock:
+            if self.pin_max_age:
+                self.conn.execute('DELETE FROM pins WHERE updated_at < ?', (now - self.pin_max_age,))
+                self.conn.commit()
+        for folder, (max_bytes, max_age) in self.budgets.items():
+            with self.lock:
+                rows = self.conn.execute(
+                    'SELECT name, size, accessed_at FROM files WHERE folder = ? AND evicted = 0 '
+                    'ORDER BY accessed_at', (folder,)
+                ).fetchall()
+                pinned = {path for path, in self.conn.execute('SELECT path FROM pins')}
+            
+            total = sum(size for _, size, _ in rows)
+            victims: List[str] = []
+            for name, size, accessed_at in rows:
+                if now - accessed_at < self.grace_period:
+                    break
+                if os.path.join(self.folders[folder], name) in pinned:
+                    continue
+                expired = max_age and now - accessed_at > max_age
+                if not expired and not (max_bytes and total > max_bytes):
+                    break
+                victims.append(name)
+                total -= size
+            
+            for name in victims:
+                self._evict(folder, name)
+            
+            # Les entrées évincées ne servent plus au-delà de deux fois la rétention
+            if max_age:
+                with self.lock:
+                    self.conn.execute(
+                        'DELETE FROM files WHERE folder = ? AND evicted = 1 AND accessed_at < ?',
+                        (folder, now - 2 * max_age)
+                    )
+                    self.conn.commit()
+    
+    def _evict(self, folder: str, name: str):
+        path = os.path.join(self.folders[folder], name)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            size = 0
+        except OSError as e:
+            print(f"⚠️ Suppression impossible de {path}: {e}")
+            return
+        # Dossier d'upload ou de job devenu vide
+        directory = os.path.dirname(path)
+        if directory != self.folders[folder]:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+        with self.lock:
+            self.conn.execute('UPDATE files SET evicted = 1 WHERE folder = ? AND name = ?', (folder, name))
+            self.conn.commit()
+            self.evicted_files += 1
+            self.evicted_bytes += size
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Occupation de chaque dossier et volume évincé depuis le démarrage
+        """
+        with self.lock:
+            folders = {}
+            for folder, (max_bytes, max_age) in self.budgets.items():
+                row = self.conn.execute(
+                    'SELECT files, bytes FROM folder_totals WHERE folder = ?', (folder,)
+                ).fetchone()
+                count, total = row or (0, 0)
+                folders[folder] = {'files': count, 'bytes': total, 'max_bytes': int(max_bytes), 'max_age_seconds': int(max_age)}
+            return {'folders': folders, 'evicted_files': self.evicted_files, 'evicted_bytes': self.evicted_bytes}